@@ -740,13 +740,30 @@ class mkdepthcharge(
 
             # The subimage nodes can be <type>@1 or <type>-1.
             def subimage_by_type(fit_image, subimage_type):
-                for subimage in fdtget.subnodes(fit_image, "/images"):
-                    node = "/images/{}".format(subimage)
-                    try:
-                        if fdtget.get(fit_image, node, "type") == subimage_type:
-                            return node
-                    except:
-                        continue
+                nodes = [
+                    "/images/{}".format(subimage)
+                    for subimage in fdtget.subnodes(fit_image, "/images")
+                ]
+
+                try:
+                    types = fdtget.get_many(
+                        fit_image,
+                        [(node, "type") for node in nodes],
+                        default="",
+                    )
+
+                # Skip only the nodes we can't read types of
+                except:
+                    types = []
+                    for node in nodes:
+                        try:
+                            types.append(fdtget.get(fit_image, node, "type"))
+                        except:
+                            types.append(None)
+
+                for node, type_ in zip(nodes, types):
+                    if type_ == subimage_type:
+                        return node
 
             # On later 32-bit ARM Chromebooks, the KERNEL_START address
             # can be very close to the where kernel decompresses itself
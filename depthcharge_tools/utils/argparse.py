@@ -6,6 +6,7 @@
 # See COPYRIGHT and LICENSE files for full copyright information.
 
 import argparse
+import collections
 import copy
 import contextlib
 import functools
@@ -571,15 +572,15 @@ class Group(_MethodDecorator):
     def build(self, parent):
         parser = parent.add_argument_group(*self._args, **self.__kwargs)
 
-        items = list(self._arguments)
+        items = collections.deque(self._arguments)
         while items:
-            item = items.pop(0)
+            item = items.popleft()
             item.__get__(self.__self__, type(self.__self__))
 
             # Argparse doesn't print help message for nested groups,
             # so we flatten them here.
             if isinstance(item, Group):
-                items = list(item._arguments) + items
+                items.extendleft(reversed(item._arguments))
                 continue
 
             item.build(parser)
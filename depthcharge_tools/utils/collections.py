@@ -111,24 +111,48 @@ def TypedList(T):
 class DirectedGraph:
     def __init__(self):
         self.__edges = {}
+        self.__parents = {}
 
     def add_edge(self, node, child):
         self.add_node(node)
         self.add_node(child)
         self.__edges[node].add(child)
+        self.__parents[child].add(node)
 
     def add_node(self, node):
         if node not in self.__edges:
             self.__edges[node] = set()
+            self.__parents[node] = set()
+
+    # Same as add_edge() for each, without the per-edge method calls
+    def add_edges(self, *edges):
+        for node, child in edges:
+            if node not in self.__edges:
+                self.__edges[node] = set()
+                self.__parents[node] = set()
+            if child not in self.__edges:
+                self.__edges[child] = set()
+                self.__parents[child] = set()
+            self.__edges[node].add(child)
+            self.__parents[child].add(node)
 
     def remove_edge(self, node, child):
         if node in self.__edges:
             self.__edges[node].discard(child)
+        if child in self.__parents:
+            self.__parents[child].discard(node)
 
     def remove_node(self, node):
-        self.__edges.pop(node, None)
-        for k, v in self.__edges.items():
-            v.discard(node)
+        children = self.__edges.pop(node, set())
+        parents = self.__parents.pop(node, set())
+
+        for child in children:
+            if child in self.__parents:
+                self.__parents[child].discard(node)
+
+        for parent in parents:
+            if parent in self.__edges:
+                self.__edges[parent].discard(node)
 
     def replace_node(self, node, replacement, merge=False):
         if replacement in self.__edges and not merge:
@@ -157,6 +181,10 @@ class DirectedGraph:
     def nodes(self):
         return set(self.__edges.keys())
 
+    # Membership checks without copying all nodes into a new set
+    def __contains__(self, node):
+        return node in self.__edges
+
     def children(self, *nodes):
         node_children = set()
         for node in nodes:
@@ -166,31 +194,28 @@ class DirectedGraph:
 
     def parents(self, *nodes):
         node_parents = set()
-        for parent, children in self.__edges.items():
-            if children.intersection(nodes):
-                node_parents.add(parent)
+        for node in nodes:
+            node_parents.update(self.__parents.get(node, set()))
 
         return node_parents
 
+    # Only look up the parents of nodes found in the last step, the
+    # others were already visited.
     def ancestors(self, *nodes):
-        nodes = set(nodes)
-
         ancestors = self.parents(*nodes)
-        tmp = self.parents(*ancestors)
-        while tmp - ancestors:
+        tmp = ancestors
+        while tmp:
+            tmp = self.parents(*tmp) - ancestors
             ancestors.update(tmp)
-            tmp = self.parents(*ancestors)
 
         return ancestors
 
     def descendants(self, *nodes):
-        nodes = set(nodes)
-
         descendants = self.children(*nodes)
-        tmp = self.children(*descendants)
-        while tmp - descendants:
+        tmp = descendants
+        while tmp:
+            tmp = self.children(*tmp) - descendants
             descendants.update(tmp)
-            tmp = self.children(*descendants)
 
         return descendants
 
@@ -216,8 +241,7 @@ class DirectedGraph:
 
         roots = set()
         if len(nodes) == 0:
-            roots.update(self.__edges.keys())
-            roots.difference_update(*self.__edges.values())
+            roots.update(k for k, v in self.__parents.items() if not v)
             return roots
 
         roots = self.roots()
@@ -6,6 +6,7 @@
 # See COPYRIGHT and LICENSE files for full copyright information.
 
 import collections
+import os
 import re
 import shlex
 
@@ -15,7 +16,7 @@ from depthcharge_tools.utils.collections import (
     DirectedGraph,
 )
 from depthcharge_tools.utils.pathlib import (
-    iterdir,
+    listdir,
     read_lines,
 )
 from depthcharge_tools.utils.platform import (
@@ -26,6 +27,18 @@ from depthcharge_tools.utils.subprocess import (
 )
 
 
+# Kernel escapes whitespace and backslashes in mount tables as octal
+def unescape_mount_field(field):
+    if "\\" not in field:
+        return field
+
+    return re.sub(
+        r"\\([0-7]{3})",
+        lambda m: chr(int(m.group(1), 8)),
+        field,
+    )
+
+
 class Disks(DirectedGraph):
     def __init__(
         self,
@@ -47,59 +60,134 @@ class Disks(DirectedGraph):
         self._mountinfo = mountinfo = Path(mountinfo)
         self._crypttab = crypttab = Path(crypttab)
 
-        for sysdir in iterdir(sys / "class" / "block"):
-            for device in read_lines(sysdir / "dm" / "name"):
-                self.add_edge(dev / sysdir.name, dev / "mapper" / device)
-
-            for device in iterdir(sysdir / "slaves"):
-                self.add_edge(dev / device.name, dev / sysdir.name)
-
-            for device in iterdir(sysdir / "holders"):
-                self.add_edge(dev / sysdir.name, dev / device.name)
-
-            for device in iterdir(sysdir):
-                if device.name.startswith(sysdir.name):
-                    self.add_edge(dev / sysdir.name, dev / device.name)
+        # Directories of udev symlinks for tagged names, e.g. UUID=*
+        self._dev_link_dirs = (
+            dev / "disk" / "by-id",
+            dev / "disk" / "by-label",
+            dev / "disk" / "by-partlabel",
+            dev / "disk" / "by-uuid",
+            dev / "disk" / "by-partuuid",
+            dev / "mapper",
+        )
 
-        for line in read_lines(crypttab):
+        self.__dev_links = None
+        self.__crypttab_devices = None
+        self.__fstab_mounts = None
+        self.__procmounts_mounts = None
+        self.__mtab_mounts = None
+        self.__mountinfo_mounts = None
+
+        # Slaves and holders list the same relations from both sides,
+        # so collect them first to evaluate each edge only once.
+        sys_edges = set()
+        sys_block = os.path.join(sys, "class", "block")
+        for name in listdir(sys_block):
+            sysdir = os.path.join(sys_block, name)
+            entries = listdir(sysdir)
+
+            if "dm" in entries:
+                for device in read_lines(Path(sysdir, "dm", "name")):
+                    sys_edges.add((name, "mapper/{}".format(device)))
+
+            if "slaves" in entries:
+                for device in listdir(os.path.join(sysdir, "slaves")):
+                    sys_edges.add((device, name))
+
+            if "holders" in entries:
+                for device in listdir(os.path.join(sysdir, "holders")):
+                    sys_edges.add((name, device))
+
+            for device in entries:
+                if device.startswith(name):
+                    sys_edges.add((name, device))
+
+        # Devices appear in many edges, only check each one once
+        sys_nodes = {}
+        for edge in sys_edges:
+            for name in edge:
+                if name not in sys_nodes:
+                    device = os.path.join(dev, name)
+                    sys_nodes[name] = self.evaluate(device)
+
+        for node, child in sys_edges:
+            node, child = sys_nodes[node], sys_nodes[child]
+            if node is not None and child is not None and node != child:
+                super().add_edge(node, child)
+
+        for cryptdev, device in self._crypttab_devices.items():
+            if device != 'none':
+                cryptdev = dev / "mapper" / cryptdev
+                self.add_edge(device, cryptdev)
+
+    def _load_dev_links(self):
+        dev_links = {}
+        for linkdir in self._dev_link_dirs:
+            try:
+                entries = list(os.scandir(linkdir))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.is_symlink():
+                    dev_links[entry.path] = Path(os.path.realpath(entry.path))
+
+        return dev_links
+
+    def _load_crypttab(self):
+        crypttab_devices = {}
+        for line in read_lines(self._crypttab):
             if line and not line.startswith("#"):
                 fields = shlex.split(line)
                 cryptdev, device = fields[0], fields[1]
-                if device != 'none':
-                    cryptdev = dev / "mapper" / cryptdev
-                    self.add_edge(device, cryptdev)
+                crypttab_devices[cryptdev] = device
+
+        return crypttab_devices
 
+    def _load_fstab(self):
         fstab_mounts = {}
-        for line in read_lines(fstab):
+        for line in read_lines(self._fstab):
             if line and not line.startswith("#"):
                 fields = shlex.split(line)
                 device, mount = fields[0], fields[1]
                 if mount != 'none':
                     fstab_mounts[mount] = device
 
+        return fstab_mounts
+
+    def _load_procmounts(self):
         procmounts_mounts = {}
-        for line in read_lines(procmounts):
+        for line in read_lines(self._procmounts):
             if line and not line.startswith("#"):
-                fields = shlex.split(line)
-                device, mount = fields[0], fields[1]
+                fields = line.split()
+                device = unescape_mount_field(fields[0])
+                mount = unescape_mount_field(fields[1])
                 device = self.evaluate(device)
                 if device is not None:
                     procmounts_mounts[mount] = device
 
+        return procmounts_mounts
+
+    def _load_mtab(self):
         mtab_mounts = {}
-        for line in read_lines(mtab):
+        for line in read_lines(self._mtab):
             if line and not line.startswith("#"):
-                fields = shlex.split(line)
-                device, mount = fields[0], fields[1]
+                fields = line.split()
+                device = unescape_mount_field(fields[0])
+                mount = unescape_mount_field(fields[1])
                 device = self.evaluate(device)
                 if device is not None:
                     mtab_mounts[mount] = device
 
+        return mtab_mounts
+
+    def _load_mountinfo(self):
         mountinfo_mounts = {}
-        for line in read_lines(mountinfo):
+        for line in read_lines(self._mountinfo):
             if line and not line.startswith("#"):
-                fields = shlex.split(line)
-                device, fsroot, mount = fields[2], fields[3], fields[4]
+                fields = line.split()
+                device = unescape_mount_field(fields[2])
+                fsroot = unescape_mount_field(fields[3])
+                mount = unescape_mount_field(fields[4])
                 if fsroot != "/":
                     mountinfo_mounts[mount] = None
                     continue
@@ -107,22 +195,75 @@ class Disks(DirectedGraph):
                 if device is not None:
                     mountinfo_mounts[mount] = device
 
-        mounts = collections.ChainMap(
-            fstab_mounts,
-            mountinfo_mounts,
-            procmounts_mounts,
-            mtab_mounts,
+        return mountinfo_mounts
+
+    # Mount tables aren't needed for most queries, so only parse them
+    # the first time something actually asks for them.
+    @property
+    def _dev_links(self):
+        if self.__dev_links is None:
+            self.__dev_links = self._load_dev_links()
+        return self.__dev_links
+
+    @property
+    def _crypttab_devices(self):
+        if self.__crypttab_devices is None:
+            self.__crypttab_devices = self._load_crypttab()
+        return self.__crypttab_devices
+
+    @property
+    def _fstab_mounts(self):
+        if self.__fstab_mounts is None:
+            self.__fstab_mounts = self._load_fstab()
+        return self.__fstab_mounts
+
+    @property
+    def _procmounts_mounts(self):
+        if self.__procmounts_mounts is None:
+            self.__procmounts_mounts = self._load_procmounts()
+        return self.__procmounts_mounts
+
+    @property
+    def _mtab_mounts(self):
+        if self.__mtab_mounts is None:
+            self.__mtab_mounts = self._load_mtab()
+        return self.__mtab_mounts
+
+    @property
+    def _mountinfo_mounts(self):
+        if self.__mountinfo_mounts is None:
+            self.__mountinfo_mounts = self._load_mountinfo()
+        return self.__mountinfo_mounts
+
+    @property
+    def _mounts(self):
+        return collections.ChainMap(
+            self._fstab_mounts,
+            self._mountinfo_mounts,
+            self._procmounts_mounts,
+            self._mtab_mounts,
         )
 
-        self._fstab_mounts = fstab_mounts
-        self._procmounts_mounts = procmounts_mounts
-        self._mtab_mounts = mtab_mounts
-        self._mountinfo_mounts = mountinfo_mounts
-        self._mounts = mounts
+    def _resolve(self, device):
+        device = Path(device)
+
+        # Tagged names are udev symlinks we can resolve all at once.
+        # Links might have changed since then, in which case resolve
+        # them again like any other path.
+        if device.parent in self._dev_link_dirs:
+            path = self._dev_links.get(str(device), None)
+            if path is not None and path.exists():
+                return path
+
+        return device.resolve()
 
     def __getitem__(self, key):
         return self.evaluate(key)
 
+    # Nodes are evaluated devices, so look for what the key evaluates to
+    def __contains__(self, key):
+        return super().__contains__(self.evaluate(key))
+
     def evaluate(self, device):
         dev = self._dev
         sys = self._sys
@@ -136,7 +277,15 @@ class Disks(DirectedGraph):
         elif isinstance(device, (Disk, Partition)):
             device = str(device.path)
 
-        if device.startswith("ID="):
+        # Plain device paths don't need any translation, the mapper
+        # ones are handled below as they might need crypttab lookups.
+        if (
+            device.startswith("{}/".format(dev))
+            and not device.startswith("{}/".format(dev / "mapper"))
+        ):
+            pass
+
+        elif device.startswith("ID="):
             id_ = device[len("ID="):]
             if not id_:
                 return None
@@ -178,7 +327,7 @@ class Disks(DirectedGraph):
                 device = dev / "disk" / "by-partuuid" / partuuid.lower()
 
             if partnroff:
-                device = device.resolve()
+                device = self._resolve(device)
                 match = re.match("(.*[^0-9])([0-9]+)$", device.name)
                 if not match:
                     return None
@@ -193,15 +342,9 @@ class Disks(DirectedGraph):
         # than in the crypttab file, so check that as well.
         elif device.startswith(str(dev / "mapper")):
             if not Path(device).resolve().exists():
-                for line in read_lines(self._crypttab):
-                    if not line or line.startswith("#"):
-                        continue
-
-                    fields = shlex.split(line)
-                    parentdev, cryptdev = fields[1], fields[0]
-                    if cryptdev != device.split("/")[-1]:
-                        continue
-
+                cryptdev = device.split("/")[-1]
+                parentdev = self._crypttab_devices.get(cryptdev, None)
+                if parentdev is not None:
                     parentdev = self.evaluate(parentdev)
                     siblings = self.children(parentdev)
                     if len(siblings) == 1:
@@ -213,19 +356,26 @@ class Disks(DirectedGraph):
                     else:
                         device = str(parentdev)
 
-        device = Path(device).resolve()
+        device = self._resolve(device)
         if not device.exists() or dev not in device.parents:
             return None
 
-        try:
-            return Partition(device, dev=dev, sys=sys)
-        except:
-            pass
+        # Check what Partition() and Disk() would accept instead of
+        # relying on their exceptions, this runs for every graph node.
+        if device.parent == dev and device.is_block_device():
+            match = (
+                re.fullmatch("(.*[0-9])p([0-9]+)", device.name)
+                or re.fullmatch("(.*[^0-9])([0-9]+)", device.name)
+            )
+            if match and int(match.group(2)) > 0:
+                disk = device.with_name(match.group(1))
+                if disk.is_file() or disk.is_block_device():
+                    return Partition(device, dev=dev, sys=sys)
 
-        try:
+        if device.is_file() or device.is_block_device():
             return Disk(device, dev=dev, sys=sys)
-        except:
-            pass
+
+        return None
 
     def by_mountpoint(self, mountpoint, fstab_only=False):
         if not Path(mountpoint).exists():
@@ -5,6 +5,7 @@
 # Copyright (C) 2020-2022 Alper Nebi Yasak <alpernebiyasak@gmail.com>
 # See COPYRIGHT and LICENSE files for full copyright information.
 
+import os
 import shutil
 import subprocess
 
@@ -25,11 +26,52 @@ def copy(src, dest):
     return Path(dest)
 
 
+# Runners that might decompress data starting with these bytes, in the
+# order we should try them. Skippable frames are common to zstd and lz4.
+def compression_runners(head):
+    skippable = (
+        len(head) >= 4
+        and 0x50 <= head[0] <= 0x5f
+        and head[1:4] == b"\x2a\x4d\x18"
+    )
+
+    # gzip also reads compress, pack and LZH data
+    if head.startswith((b"\x1f\x8b", b"\x1f\x9d", b"\x1f\x1e", b"\x1f\xa0")):
+        yield gzip
+    if head.startswith(b"\x28\xb5\x2f\xfd") or skippable:
+        yield zstd
+    if head.startswith(b"\xfd7zXZ\x00"):
+        yield xz
+    # Frame and legacy formats
+    if head.startswith((b"\x04\x22\x4d\x18", b"\x02\x21\x4c\x18")):
+        yield lz4
+    elif skippable:
+        yield lz4
+    # No magic, but the first byte is (lc, lp, pb) and must be < 9*5*5
+    if head and head[0] < 225:
+        yield lzma
+    if head.startswith(b"BZh"):
+        yield bzip2
+    if head.startswith(b"\x89LZO\x00\r\n\x1a\n"):
+        yield lzop
+
+
 def decompress(src, dest=None, partial=False):
     if dest is not None:
         dest = Path(dest)
 
-    for runner in (gzip, zstd, xz, lz4, lzma, bzip2, lzop):
+    # Avoid trying runners that would certainly fail
+    try:
+        if isinstance(src, bytes):
+            head = src[:16]
+        else:
+            with Path(src).open("rb") as f:
+                head = f.read(16)
+        runners = list(compression_runners(head))
+    except OSError:
+        runners = (gzip, zstd, xz, lz4, lzma, bzip2, lzop)
+
+    for runner in runners:
         try:
             return runner.decompress(src, dest)
 
@@ -58,11 +100,46 @@ def iterdir(path):
         return []
 
 
-def read_lines(path):
+def listdir(path):
     try:
-        if path.is_file():
-            return path.read_text().splitlines()
-        else:
-            return []
-    except:
+        return os.listdir(path)
+    except OSError:
         return []
+
+
+def read_text(path):
+    # Plain open+read without stat() calls first, these are usually
+    # small sysfs/procfs files that might not exist.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    return b"".join(chunks).decode("utf-8")
+
+
+# Yields lines as they're read instead of building a list of all of
+# them, callers usually only care about a few lines of large files.
+def read_lines(path):
+    try:
+        if not path.is_file():
+            return
+
+        with path.open() as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    except (OSError, ValueError):
+        return
@@ -5,42 +5,62 @@
 # Copyright (C) 2020-2022 Alper Nebi Yasak <alpernebiyasak@gmail.com>
 # See COPYRIGHT and LICENSE files for full copyright information.
 
-import collections
-import glob
-import platform
+import fnmatch
+import os
 import re
 import shlex
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
 from pathlib import Path
 
 from depthcharge_tools.utils.pathlib import (
     decompress,
+    listdir,
+    read_text,
 )
 from depthcharge_tools.utils.subprocess import (
     crossystem,
 )
 
 
+# These read files that don't change while we're running, so results
+# are cached. Callers must not modify the returned objects.
+@lru_cache
 def dt_compatibles():
-    dt_model = Path("/proc/device-tree/compatible")
-    if dt_model.exists():
-        return dt_model.read_text().strip("\x00").split("\x00")
+    text = read_text("/proc/device-tree/compatible")
+    if text is not None:
+        return text.strip("\x00").split("\x00")
 
 
+@lru_cache
 def dt_model():
-    dt_model = Path("/proc/device-tree/model")
-    if dt_model.exists():
-        return dt_model.read_text().strip("\x00")
+    text = read_text("/proc/device-tree/model")
+    if text is not None:
+        return text.strip("\x00")
 
 
+@lru_cache
+def _cros_acpi_devices():
+    # Shared by cros_hwid() and cros_fwid() so we only list this once.
+    devices = Path("/sys/bus/platform/devices")
+    return tuple(
+        devices / name
+        for name in sorted(listdir(devices))
+        if name.startswith("GGL0001:")
+    )
+
+
+@lru_cache
 def cros_hwid():
-    hwid_file = Path("/proc/device-tree/firmware/chromeos/hardware-id")
-    if hwid_file.exists():
-        return hwid_file.read_text().strip("\x00")
+    hwid = read_text("/proc/device-tree/firmware/chromeos/hardware-id")
+    if hwid is not None:
+        return hwid.strip("\x00")
 
-    for hwid_file in Path("/sys/bus/platform/devices").glob("GGL0001:*/HWID"):
-        if hwid_file.exists():
-            return hwid_file.read_text().strip()
+    for device in _cros_acpi_devices():
+        hwid = read_text(device / "HWID")
+        if hwid is not None:
+            return hwid.strip()
 
     # Try crossystem as a last resort
     try:
@@ -49,14 +69,16 @@ def cros_hwid():
         pass
 
 
+@lru_cache
 def cros_fwid():
-    fwid_file = Path("/proc/device-tree/firmware/chromeos/firmware-version")
-    if fwid_file.exists():
-        return fwid_file.read_text().strip("\x00")
+    fwid = read_text("/proc/device-tree/firmware/chromeos/firmware-version")
+    if fwid is not None:
+        return fwid.strip("\x00")
 
-    for fwid_file in Path("/sys/bus/platform/devices").glob("GGL0001:*/FWID"):
-        if fwid_file.exists():
-            return fwid_file.read_text().strip()
+    for device in _cros_acpi_devices():
+        fwid = read_text(device / "FWID")
+        if fwid is not None:
+            return fwid.strip()
 
     # Try crossystem as a last resort
     try:
@@ -65,25 +87,34 @@ def cros_fwid():
         pass
 
 
+@lru_cache
 def os_release(root=None):
-    os_release = {}
-
     if root is None:
         root = "/"
-    root = Path(root).resolve()
+    return _os_release(Path(root).resolve())
+
+
+# Takes an already resolved root, for callers that have one at hand.
+@lru_cache
+def _os_release(root):
+    os_release = {}
 
     os_release_f = root / "etc" / "os-release"
     if not os_release_f.exists():
         os_release_f = root / "usr" / "lib" / "os-release"
 
     if os_release_f.exists():
-        for line in os_release_f.read_text().splitlines():
-            lhs, _, rhs = line.partition("=")
+        for lhs, rhs in re.findall(
+            "^([A-Za-z0-9_]+)=(.*)$",
+            os_release_f.read_text(),
+            flags=re.MULTILINE,
+        ):
             os_release[lhs] = rhs.strip('\'"')
 
     return os_release
 
 
+@lru_cache
 def kernel_cmdline(root=None):
     cmdline = ""
 
@@ -91,34 +122,39 @@ def kernel_cmdline(root=None):
         root = "/"
     root = Path(root).resolve()
 
-    cmdline_f = root / "etc" / "kernel" / "cmdline"
-    if not cmdline_f.exists():
-        cmdline_f = root / "usr" / "lib" / "kernel" / "cmdline"
+    text = read_text(root / "etc" / "kernel" / "cmdline")
+    if text is None:
+        text = read_text(root / "usr" / "lib" / "kernel" / "cmdline")
 
-    if cmdline_f.exists():
-        cmdline = cmdline_f.read_text().rstrip("\n")
+    if text is not None:
+        cmdline = text.rstrip("\n")
 
     return shlex.split(cmdline)
 
 
+@lru_cache
 def proc_cmdline():
     cmdline = ""
 
-    cmdline_f = Path("/proc/cmdline")
-    if cmdline_f.exists():
-        cmdline = cmdline_f.read_text().rstrip("\n")
+    text = read_text("/proc/cmdline")
+    if text is not None:
+        cmdline = text.rstrip("\n")
 
     return shlex.split(cmdline)
 
 
+@lru_cache
 def is_cros_boot():
     dt_cros_firmware = Path("/proc/device-tree/firmware/chromeos")
     if dt_cros_firmware.is_dir():
         return True
 
-    # Chrome OS firmware injects this into the kernel cmdline.
-    if "cros_secure" in proc_cmdline():
-        return True
+    # Chrome OS firmware injects this into the kernel cmdline, as a
+    # bare word so we don't need shlex to find it.
+    text = read_text("/proc/cmdline")
+    if text is not None:
+        if "cros_secure" in text.split():
+            return True
 
     return False
 
@@ -131,34 +167,34 @@ def is_cros_libreboot():
     return fwid.lower().startswith("libreboot")
 
 
-def root_requires_initramfs(root):
+def root_cmdline_pattern():
     x = "[0-9a-fA-F]"
     uuid = "{x}{{8}}-{x}{{4}}-{x}{{4}}-{x}{{4}}-{x}{{12}}".format(x=x)
     ntsig = "{x}{{8}}-{x}{{2}}".format(x=x)
 
     # Depthcharge replaces %U with an uuid, so we can use that as well.
-    uuid = "({}|%U)".format(uuid)
+    partuuid = "(?:{}|%U|{})".format(uuid, ntsig)
 
     # Tries to validate the root=* kernel cmdline parameter.
     # See init/do_mounts.c in Linux tree.
-    for pat in (
+    patterns = (
         "[0-9a-fA-F]{4}",
         "/dev/nfs",
+        # Also covers /dev/<disk><partno> and /dev/<disk>p<partno>
         "/dev/[0-9a-zA-Z]+",
-        "/dev/[0-9a-zA-Z]+[0-9]+",
-        "/dev/[0-9a-zA-Z]+p[0-9]+",
-        "PARTUUID=({uuid}|{ntsig})".format(uuid=uuid, ntsig=ntsig),
-        "PARTUUID=({uuid}|{ntsig})/PARTNROFF=[0-9]+".format(
-            uuid=uuid, ntsig=ntsig,
-        ),
+        "PARTUUID={}(?:/PARTNROFF=[0-9]+)?".format(partuuid),
         "[0-9]+:[0-9]+",
         "PARTLABEL=.+",
         "/dev/cifs",
-    ):
-        if re.fullmatch(pat, root):
-            return False
+    )
 
-    return True
+    return re.compile("|".join("(?:{})".format(pat) for pat in patterns))
+
+root_cmdline_pattern = root_cmdline_pattern()
+
+
+def root_requires_initramfs(root):
+    return root_cmdline_pattern.fullmatch(root) is None
 
 
 def vboot_keys(*keydirs, system=True, root=None):
@@ -175,19 +211,21 @@ def vboot_keys(*keydirs, system=True, root=None):
         )
 
     for keydir in keydirs:
+        # Listing fails for missing dirs, no need to check separately
         keydir = Path(keydir)
-        if not keydir.is_dir():
+        names = listdir(keydir)
+        if not names:
             continue
 
         keyblock = keydir / "kernel.keyblock"
         signprivate = keydir / "kernel_data_key.vbprivk"
         signpubkey = keydir / "kernel_subkey.vbpubk"
 
-        if not keyblock.exists():
+        if keyblock.name not in names:
             keyblock = None
-        if not signprivate.exists():
+        if signprivate.name not in names:
             signprivate = None
-        if not signpubkey.exists():
+        if signpubkey.name not in names:
             signpubkey = None
 
         if keyblock or signprivate or signpubkey:
@@ -199,35 +237,39 @@ def vboot_keys(*keydirs, system=True, root=None):
 def cpu_microcode(boot=None):
     microcode = []
 
-    for f in (
-        *boot.glob("amd-ucode.img"),
-        *boot.glob("amd-uc.img"),
-    ):
-        if f.is_file():
-            microcode.append(f)
-            break
+    # These are all fixed names, one listing answers all of them
+    names = set(listdir(boot))
 
-    for f in (
-        *boot.glob("intel-ucode.img"),
-        *boot.glob("intel-uc.img"),
-    ):
-        if f.is_file():
-            microcode.append(f)
-            break
+    def first_file(*candidates):
+        for name in candidates:
+            if name in names and (boot / name).is_file():
+                return boot / name
+
+    amd = first_file("amd-ucode.img", "amd-uc.img")
+    if amd is not None:
+        microcode.append(amd)
+
+    intel = first_file("intel-ucode.img", "intel-uc.img")
+    if intel is not None:
+        microcode.append(intel)
 
     if not microcode:
-        for f in (
-            *boot.glob("early_ucode.cpio"),
-            *boot.glob("microcode.cpio"),
-        ):
-            if f.is_file():
-                microcode.append(f)
-                break
+        early = first_file("early_ucode.cpio", "microcode.cpio")
+        if early is not None:
+            microcode.append(early)
 
     return microcode
 
 
+# Installed kernels don't change while we're running, but callers may
+# modify the returned list, so keep a tuple in the cache and return a
+# copy of it. Use installed_kernels.cache_clear() after (un)installing.
 def installed_kernels(root=None, boot=None):
+    return list(_installed_kernels(root=root, boot=boot))
+
+
+@lru_cache
+def _installed_kernels(root=None, boot=None):
     kernels = {}
     initrds = {}
     fdtdirs = {}
@@ -240,124 +282,202 @@ def installed_kernels(root=None, boot=None):
         boot = root / "boot"
     boot = Path(boot).resolve()
 
+    # Listings are independent, do them concurrently so that a slow
+    # filesystem (e.g. NFS root) doesn't make us wait on each in turn.
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        def listdirs(paths):
+            return dict(zip(paths, executor.map(listdir, paths)))
+
+        top_dirs = listdirs((
+            root,
+            boot,
+            root / "usr" / "lib",
+            root / "lib" / "modules",
+            root / "usr" / "lib" / "modules",
+        ))
+
+        release_dirs = listdirs([
+            root / modules / release
+            for modules in ("lib/modules", "usr/lib/modules")
+            for release in sorted(top_dirs[root / modules])
+        ])
+
+    # Most of what we look for is directly in these, so list each only
+    # once instead of globbing them again for every possible name.
+    root_names = set(top_dirs[root])
+    boot_names = set(top_dirs[boot])
+    usr_lib_names = set(top_dirs[root / "usr" / "lib"])
+
+    # Most patterns are exact names, which are just set lookups
+    def names_glob(path, names, pattern):
+        if not any(c in pattern for c in "*?["):
+            return [path / pattern] if pattern in names else []
+        return [path / n for n in sorted(fnmatch.filter(names, pattern))]
+
+    def root_glob(pattern):
+        return names_glob(root, root_names, pattern)
+
+    def boot_glob(pattern):
+        return names_glob(boot, boot_names, pattern)
+
+    def usr_lib_glob(pattern):
+        return names_glob(root / "usr" / "lib", usr_lib_names, pattern)
+
+    # Same for each release directory under the module directories
+    modules_names = {
+        modules: {
+            release: set(release_dirs[root / modules / release])
+            for release in sorted(top_dirs[root / modules])
+        } for modules in ("lib/modules", "usr/lib/modules")
+    }
+
+    def modules_glob(modules, name):
+        return [
+            root / modules / release / name
+            for release, names in modules_names[modules].items()
+            if name in names
+        ]
+
+    # Matches share a few parent directories, resolve each of those
+    # only once and only fully resolve matches that are symlinks.
+    realdirs = {}
+    def resolve(f):
+        parent = str(f.parent)
+        if parent not in realdirs:
+            realdirs[parent] = os.path.realpath(parent)
+        if f.is_symlink():
+            return Path(os.path.realpath(f))
+        return Path(realdirs[parent], f.name)
+
+    # Stop walking the tree as soon as we see the first duplicate
+    def has_duplicate_dtbs(d):
+        seen = set()
+        for _, _, files in os.walk(d, followlinks=True):
+            for name in fnmatch.filter(files, "*.dtb"):
+                if name in seen:
+                    return True
+                seen.add(name)
+
+        return False
+
     for f in (
-        *root.glob("lib/modules/*/vmlinuz"),
-        *root.glob("lib/modules/*/vmlinux"),
-        *root.glob("lib/modules/*/Image"),
-        *root.glob("lib/modules/*/zImage"),
-        *root.glob("lib/modules/*/bzImage"),
-        *root.glob("usr/lib/modules/*/vmlinuz"),
-        *root.glob("usr/lib/modules/*/vmlinux"),
-        *root.glob("usr/lib/modules/*/Image"),
-        *root.glob("usr/lib/modules/*/zImage"),
-        *root.glob("usr/lib/modules/*/bzImage"),
+        *modules_glob("lib/modules", "vmlinuz"),
+        *modules_glob("lib/modules", "vmlinux"),
+        *modules_glob("lib/modules", "Image"),
+        *modules_glob("lib/modules", "zImage"),
+        *modules_glob("lib/modules", "bzImage"),
+        *modules_glob("usr/lib/modules", "vmlinuz"),
+        *modules_glob("usr/lib/modules", "vmlinux"),
+        *modules_glob("usr/lib/modules", "Image"),
+        *modules_glob("usr/lib/modules", "zImage"),
+        *modules_glob("usr/lib/modules", "bzImage"),
     ):
         if not f.is_file():
             continue
         release = f.parent.name
-        kernels[release] = f.resolve()
+        kernels[release] = resolve(f)
 
     for f in (
-        *boot.glob("vmlinuz-*"),
-        *boot.glob("vmlinux-*"),
+        *boot_glob("vmlinuz-*"),
+        *boot_glob("vmlinux-*"),
     ):
         if not f.is_file():
             continue
         _, _, release = f.name.partition("-")
-        kernels[release] = f.resolve()
+        kernels[release] = resolve(f)
 
     for f in (
-        *boot.glob("vmlinuz"),
-        *boot.glob("vmlinux"),
-        *root.glob("vmlinuz"),
-        *root.glob("vmlinux"),
-        *boot.glob("Image"),
-        *boot.glob("zImage"),
-        *boot.glob("bzImage"),
+        *boot_glob("vmlinuz"),
+        *boot_glob("vmlinux"),
+        *root_glob("vmlinuz"),
+        *root_glob("vmlinux"),
+        *boot_glob("Image"),
+        *boot_glob("zImage"),
+        *boot_glob("bzImage"),
     ):
         if not f.is_file():
             continue
-        kernels[None] = f.resolve()
+        kernels[None] = resolve(f)
         break
 
     for f in (
-        *root.glob("lib/modules/*/initrd"),
-        *root.glob("lib/modules/*/initramfs"),
-        *root.glob("lib/modules/*/initrd.img"),
-        *root.glob("lib/modules/*/initramfs.img"),
-        *root.glob("usr/lib/modules/*/initrd"),
-        *root.glob("usr/lib/modules/*/initramfs"),
-        *root.glob("usr/lib/modules/*/initrd.img"),
-        *root.glob("usr/lib/modules/*/initramfs.img"),
+        *modules_glob("lib/modules", "initrd"),
+        *modules_glob("lib/modules", "initramfs"),
+        *modules_glob("lib/modules", "initrd.img"),
+        *modules_glob("lib/modules", "initramfs.img"),
+        *modules_glob("usr/lib/modules", "initrd"),
+        *modules_glob("usr/lib/modules", "initramfs"),
+        *modules_glob("usr/lib/modules", "initrd.img"),
+        *modules_glob("usr/lib/modules", "initramfs.img"),
     ):
         if not f.is_file():
             continue
         release = f.parent.name
-        initrds[release] = f.resolve()
+        initrds[release] = resolve(f)
 
     for f in (
-        *boot.glob("initrd-*.img"),
-        *boot.glob("initramfs-*.img"),
+        *boot_glob("initrd-*.img"),
+        *boot_glob("initramfs-*.img"),
     ):
         if not f.is_file():
             continue
         _, _, release = f.name.partition("-")
         release = release[:-4]
-        initrds[release] = f.resolve()
+        initrds[release] = resolve(f)
 
     for f in (
-        *boot.glob("initrd-*"),
-        *boot.glob("initrd.img-*"),
-        *boot.glob("initramfs-*"),
-        *boot.glob("initramfs.img-*"),
+        *boot_glob("initrd-*"),
+        *boot_glob("initrd.img-*"),
+        *boot_glob("initramfs-*"),
+        *boot_glob("initramfs.img-*"),
     ):
         if not f.is_file():
             continue
         _, _, release = f.name.partition("-")
-        initrds[release] = f.resolve()
+        initrds[release] = resolve(f)
 
     for f in (
-        *boot.glob("initrd.img"),
-        *boot.glob("initrd"),
-        *boot.glob("initramfs-linux.img"),
-        *boot.glob("initramfs-vanilla"),
-        *boot.glob("initramfs"),
-        *root.glob("initrd.img"),
-        *root.glob("initrd"),
-        *root.glob("initramfs"),
+        *boot_glob("initrd.img"),
+        *boot_glob("initrd"),
+        *boot_glob("initramfs-linux.img"),
+        *boot_glob("initramfs-vanilla"),
+        *boot_glob("initramfs"),
+        *root_glob("initrd.img"),
+        *root_glob("initrd"),
+        *root_glob("initramfs"),
     ):
         if not f.is_file():
             continue
-        initrds[None] = f.resolve()
+        initrds[None] = resolve(f)
         break
 
     for d in (
-        *root.glob("usr/lib/linux-image-*"),
+        *usr_lib_glob("linux-image-*"),
     ):
         if not d.is_dir():
             continue
         _, _, release = d.name.partition("linux-image-")
-        fdtdirs[release] = d.resolve()
+        fdtdirs[release] = resolve(d)
 
     for d in (
-        *root.glob("lib/modules/*/dtb"),
-        *root.glob("lib/modules/*/dtbs"),
-        *root.glob("usr/lib/modules/*/dtb"),
-        *root.glob("usr/lib/modules/*/dtbs"),
+        *modules_glob("lib/modules", "dtb"),
+        *modules_glob("lib/modules", "dtbs"),
+        *modules_glob("usr/lib/modules", "dtb"),
+        *modules_glob("usr/lib/modules", "dtbs"),
     ):
         if not d.is_dir():
             continue
         release = d.parent.name
-        fdtdirs[release] = d.resolve()
+        fdtdirs[release] = resolve(d)
 
     for d in (
-        *boot.glob("dtb-*"),
-        *boot.glob("dtbs-*"),
+        *boot_glob("dtb-*"),
+        *boot_glob("dtbs-*"),
     ):
         if not d.is_dir():
             continue
         _, _, release = d.name.partition("-")
-        fdtdirs[release] = d.resolve()
+        fdtdirs[release] = resolve(d)
 
     for d in (
         *boot.glob("dtb/*"),
@@ -366,11 +486,11 @@ def installed_kernels(root=None, boot=None):
         if not d.is_dir():
             continue
         if d.name in kernels:
-            fdtdirs[d.name] = d.resolve()
+            fdtdirs[d.name] = resolve(d)
 
     for d in (
-        *boot.glob("dtbs"),
-        *boot.glob("dtb"),
+        *boot_glob("dtbs"),
+        *boot_glob("dtb"),
         *root.glob("usr/share/dtbs"),
         *root.glob("usr/share/dtb"),
     ):
@@ -378,10 +498,8 @@ def installed_kernels(root=None, boot=None):
             continue
         # Duplicate dtb files means that the directory is split by
         # kernel release and we can't use it for a single release.
-        dtbs = d.glob("**/*.dtb")
-        counts = collections.Counter(dtb.name for dtb in dtbs)
-        if all(c <= 1 for c in counts.values()):
-            fdtdirs[None] = d.resolve()
+        if not has_duplicate_dtbs(d):
+            fdtdirs[None] = resolve(d)
             break
 
     if None in kernels:
@@ -400,15 +518,19 @@ def installed_kernels(root=None, boot=None):
                 fdtdirs.setdefault(release, fdtdirs[None])
                 del fdtdirs[None]
 
-    return [
+    os_name = _os_release(root).get("NAME", None)
+
+    return tuple(
         KernelEntry(
             release,
             kernel=kernels[release],
             initrd=initrds.get(release, None),
             fdtdir=fdtdirs.get(release, None),
-            os_name=os_release(root=root).get("NAME", None),
+            os_name=os_name,
         ) for release in kernels.keys()
-    ]
+    )
+
+installed_kernels.cache_clear = _installed_kernels.cache_clear
 
 
 class KernelEntry:
@@ -418,6 +540,7 @@ class KernelEntry:
         self.initrd = initrd
         self.fdtdir = fdtdir
         self.os_name = os_name
+        self.__parts = None
 
     @property
     def description(self):
@@ -426,50 +549,77 @@ class KernelEntry:
         else:
             return "{}, with Linux {}".format(self.os_name, self.release)
 
-    @property
+    # This might need to try decompressing the kernel, do it only once
+    @cached_property
     def arch(self):
         kernel = Path(self.kernel)
 
-        decomp = decompress(kernel)
-        if decomp:
-            head = decomp[:4096]
-        else:
-            with kernel.open("rb") as f:
-                head = f.read(4096)
+        def header_arch(head):
+            if head[0x202:0x206] == b"HdrS":
+                return Architecture("x86")
+            elif head[0x38:0x3c] == b"ARM\x64":
+                return Architecture("arm64")
+            elif head[0x34:0x38] == b"\x45\x45\x45\x45":
+                return Architecture("arm")
+
+        # Most kernels have these headers as is, so avoid trying to
+        # decompress them with every compressor unless we need to.
+        with kernel.open("rb") as f:
+            arch = header_arch(f.read(4096))
+
+        if arch is None:
+            decomp = decompress(kernel)
+            if decomp:
+                arch = header_arch(decomp[:4096])
+
+        return arch
+
+    _release_pattern = re.compile("([^a-zA-Z0-9]?)([a-zA-Z]*)([0-9]*)")
 
-        if head[0x202:0x206] == b"HdrS":
-            return Architecture("x86")
-        elif head[0x38:0x3c] == b"ARM\x64":
-            return Architecture("arm64")
-        elif head[0x34:0x38] == b"\x45\x45\x45\x45":
-            return Architecture("arm")
+    # x.y.z > x.y-* == x.y* > x.y~*
+    _release_sep_order = {
+        "~": -1,
+        ".": 1,
+    }
+
+    # x.y-* == x.y* > x.y > x.y-rc* == x.y-trunk*
+    _release_text_order = {
+        "rc": -1,
+        "trunk": -1,
+    }
 
     def _comparable_parts(self):
-        pattern = "([^a-zA-Z0-9]?)([a-zA-Z]*)([0-9]*)"
+        # Sorting compares each entry many times, so parse only once
+        if self.__parts is not None:
+            return self.__parts
 
         if self.release is None:
-            return ()
+            self.__parts = ()
+            return self.__parts
+
+        # Plain x.y.z versions need none of the special cases below,
+        # build exactly what the general loop would give for them.
+        nums = self.release.split(".")
+        if self.release.isascii() and all(n.isdigit() for n in nums):
+            self.__parts = (
+                (0, (0, ""), int(nums[0])),
+                *((1, (0, ""), int(n)) for n in nums[1:]),
+                (0, (0, ""), 0),
+            )
+            return self.__parts
 
         parts = []
-        for sep, text, num in re.findall(pattern, self.release):
-            # x.y.z > x.y-* == x.y* > x.y~*
-            sep = {
-                "~": -1,
-                ".": 1,
-            }.get(sep, 0)
-
-            # x.y-* == x.y* > x.y > x.y-rc* == x.y-trunk*
-            text = ({
-                "rc": -1,
-                "trunk": -1,
-            }.get(text, 0), text)
+        for sep, text, num in self._release_pattern.findall(self.release):
+            sep = self._release_sep_order.get(sep, 0)
+            text = (self._release_text_order.get(text, 0), text)
 
             # Compare numbers as numbers
             num = int(num) if num else 0
 
             parts.append((sep, text, num))
 
-        return tuple(parts)
+        self.__parts = tuple(parts)
+        return self.__parts
 
     def __lt__(self, other):
         if not isinstance(other, KernelEntry):
@@ -503,49 +653,56 @@ class Architecture(str):
     all = arm + x86
     groups = (arm_32, arm_64, x86_32, x86_64)
 
+    _group_ids = {
+        name: i
+        for i, group in enumerate(groups)
+        for name in group
+    }
+
     def __eq__(self, other):
         if isinstance(other, Architecture):
-            for group in self.groups:
-                if self in group and other in group:
+            group = self._group_ids.get(str(self), None)
+            if group is not None:
+                if group == self._group_ids.get(str(other), None):
                     return True
         return str(self) == str(other)
 
     def __ne__(self, other):
-        if isinstance(other, Architecture):
-            for group in self.groups:
-                if self in group and other not in group:
-                    return True
-        return str(self) != str(other)
+        return not self == other
+
+    # Aliases equal each other but also their own plain strings, which
+    # no hash can agree with, so keep these unhashable.
+    __hash__ = None
+
+    _mkimage_arches = {
+        **dict.fromkeys(arm_32, "arm"),
+        **dict.fromkeys(arm_64, "arm64"),
+        **dict.fromkeys(x86_32, "x86"),
+        **dict.fromkeys(x86_64, "x86_64"),
+    }
+
+    _vboot_arches = {
+        **dict.fromkeys(arm_32, "arm"),
+        **dict.fromkeys(arm_64, "aarch64"),
+        **dict.fromkeys(x86_32, "x86"),
+        **dict.fromkeys(x86_64, "amd64"),
+    }
 
     @property
     def mkimage(self):
-        if self in self.arm_32:
-            return "arm"
-        if self in self.arm_64:
-            return "arm64"
-        if self in self.x86_32:
-            return "x86"
-        if self in self.x86_64:
-            return "x86_64"
+        return self._mkimage_arches.get(str(self), None)
 
     @property
     def vboot(self):
-        if self in self.arm_32:
-            return "arm"
-        if self in self.arm_64:
-            return "aarch64"
-        if self in self.x86_32:
-            return "x86"
-        if self in self.x86_64:
-            return "amd64"
+        return self._vboot_arches.get(str(self), None)
+
+    _kernel_arches = {
+        **dict.fromkeys(arm_32, arm_32),
+        **dict.fromkeys(arm_64, arm),
+        **dict.fromkeys(x86_32, x86_32),
+        **dict.fromkeys(x86_64, x86),
+    }
 
     @property
     def kernel_arches(self):
-        if self in self.arm_32:
-            return self.arm_32
-        if self in self.arm_64:
-            return self.arm
-        if self in self.x86_32:
-            return self.x86_32
-        if self in self.x86_64:
-            return self.x86
+        return self._kernel_arches.get(str(self), None)
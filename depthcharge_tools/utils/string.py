@@ -8,6 +8,10 @@
 import ast
 import re
 
+from functools import lru_cache
+
+# Only needed when a size has a suffix, so build it on first use.
+@lru_cache
 def bytesize_suffixes():
     def long_forms(x):
         formats = ("{}", "{}byte", "{} byte", "{}bytes", "{} bytes")
@@ -16,6 +20,7 @@ def bytesize_suffixes():
             for c in cases:
                 yield c(f.format(x))
 
+    table = {}
     for size, suffixes in {
         1:       ("B", "byte", "bytes", ""),
         1e3:     ("kB", "KB", *long_forms("kilo")),
@@ -36,9 +41,12 @@ def bytesize_suffixes():
         2 ** 80: ("YiB", "Y", *long_forms("yobi")),
     }.items():
         for suffix in suffixes:
-            yield (suffix.strip(), int(size))
+            table[suffix.strip()] = int(size)
+
+    return table
+
 
-bytesize_suffixes = dict(bytesize_suffixes())
+bytesize_suffix_pattern = re.compile(r"[a-zA-Z\s]*\Z")
 
 
 def parse_bytesize(val):
@@ -57,9 +65,9 @@ def parse_bytesize(val):
 
     try:
         s = str(val)
-        suffix = re.search("[a-zA-Z\s]*\Z", s)[0].strip()
+        suffix = bytesize_suffix_pattern.search(s)[0].strip()
         number = s.rpartition(suffix)[0].strip()
-        multiplier = bytesize_suffixes[suffix]
+        multiplier = bytesize_suffixes()[suffix]
         return int(ast.literal_eval(number)) * multiplier
 
     except Exception as err:
@@ -5,18 +5,72 @@
 # Copyright (C) 2020-2022 Alper Nebi Yasak <alpernebiyasak@gmail.com>
 # See COPYRIGHT and LICENSE files for full copyright information.
 
+import bz2
+import collections
 import contextlib
+import gzip as gzip_
+import itertools
 import logging
+import lzma as lzma_
+import os
 import re
 import subprocess
-import shlex
+import struct
+import zlib
 
 from pathlib import Path
 
+# ISA-L's zlib-compatible module is a lot faster at decompression, but
+# it's not packaged everywhere so use it only if it's available.
+try:
+    from isal import isal_zlib as zlib_
+except ImportError:
+    zlib_ = zlib
+
+# Same for python-lz4 and zstandard, which have no standard library
+# equivalents.
+try:
+    from lz4 import frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard as zstd_
+except ImportError:
+    zstd_ = None
+
+# Older zstandard releases can't tell us where a frame ends, leave
+# everything to the zstd program for those.
+if zstd_ is not None:
+    _decomp = zstd_.ZstdDecompressor().decompressobj()
+    if not (hasattr(_decomp, "eof") and hasattr(_decomp, "unused_data")):
+        zstd_ = None
+    del _decomp
+
+# The libfdt bindings let us read device-tree blobs without running
+# fdtget for every property, but they might not be installed either.
+try:
+    import libfdt
+except ImportError:
+    libfdt = None
+
 logger = logging.getLogger(__name__)
 
 
+# Calls that only look at the exit status with check=False pass
+# stderr=subprocess.DEVNULL, so we don't capture output we'd discard.
+# The rest keep capturing it, e.g. CgptRunner parses it on errors.
 class ProcessRunner:
+    # Runners of tools whose output only depends on their arguments and
+    # their input files can reuse earlier results. A result is dropped
+    # when one of its input files is replaced or has its size or mtime
+    # changed, when it's the least recently used one and the cache is
+    # full, or when any runner that might modify files is run. Changes
+    # made by other programs that keep all of those intact are missed.
+    cacheable = False
+    _results = collections.OrderedDict()
+    _results_maxsize = 128
+
     def __init__(self, *args_prefix, **kwargs_defaults):
         self.args_prefix = args_prefix
         self.kwargs_defaults = {
@@ -25,10 +79,66 @@ class ProcessRunner:
         }
         self.kwargs_defaults.update(kwargs_defaults)
 
+    def _cache_key(self, args, kwargs):
+        # These have side effects or inputs we can't keep track of
+        if {"stdin", "stdout", "input"} & kwargs.keys():
+            return None
+
+        files = []
+        for arg in self._input_files(args):
+            try:
+                st = os.stat(arg)
+                files.append((
+                    st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                ))
+            except (OSError, TypeError, ValueError):
+                files.append(None)
+
+        key = (self, args, tuple(sorted(kwargs.items())), tuple(files))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+    # Arguments that name files the output depends on
+    def _input_files(self, args):
+        return ()
+
+    # Whether running with these arguments might modify files
+    def _modifies(self, args):
+        return not self.cacheable
+
     def __call__(self, *args_suffix, **kwargs_overrides):
-        args = (*self.args_prefix, *args_suffix)
-        kwargs = {**self.kwargs_defaults, **kwargs_overrides}
+        if self._modifies(args_suffix):
+            ProcessRunner._results.clear()
+            return self._run(*args_suffix, **kwargs_overrides)
+
+        key = self._cache_key(args_suffix, kwargs_overrides)
+        if key is None:
+            return self._run(*args_suffix, **kwargs_overrides)
+
+        results = ProcessRunner._results
+        if key in results:
+            results.move_to_end(key)
+            return results[key]
 
+        proc = self._run(*args_suffix, **kwargs_overrides)
+        results[key] = proc
+        if len(results) > self._results_maxsize:
+            results.popitem(last=False)
+
+        return proc
+
+    def _run(self, *args_suffix, **kwargs_overrides):
+        # Both of these are already tuples, no need to unpack them
+        args = self.args_prefix + args_suffix
+        kwargs = self.kwargs_defaults.copy()
+        kwargs.update(kwargs_overrides)
+
+        # Files we redirect to/from are only handed to the child as
+        # file descriptors, so open them raw without any text layer.
         with contextlib.ExitStack() as ctx:
             stdin = kwargs.get("stdin", None)
             if isinstance(stdin, str):
@@ -38,7 +148,9 @@ class ProcessRunner:
                 kwargs["encoding"] = None
                 kwargs["input"] = stdin
             if isinstance(stdin, Path):
-                kwargs["stdin"] = ctx.enter_context(stdin.open("r"))
+                kwargs["stdin"] = ctx.enter_context(
+                    stdin.open("rb", buffering=0),
+                )
             if stdin is None:
                 kwargs["stdin"] = subprocess.PIPE
 
@@ -46,7 +158,9 @@ class ProcessRunner:
             if isinstance(stdout, str):
                 stdout = Path(stdout)
             if isinstance(stdout, Path):
-                kwargs["stdout"] = ctx.enter_context(stdout.open("x"))
+                kwargs["stdout"] = ctx.enter_context(
+                    stdout.open("xb", buffering=0),
+                )
             if stdout is None:
                 kwargs["stdout"] = subprocess.PIPE
 
@@ -54,7 +168,9 @@ class ProcessRunner:
             if isinstance(stderr, str):
                 stderr = Path(stderr)
             if isinstance(stderr, Path):
-                kwargs["stderr"] = ctx.enter_context(stderr.open("x"))
+                kwargs["stderr"] = ctx.enter_context(
+                    stderr.open("xb", buffering=0),
+                )
             if stderr is None:
                 kwargs["stderr"] = subprocess.PIPE
 
@@ -77,36 +193,117 @@ class ProcessRunner:
         return err
 
 
+# Helpers for runners that can do their work in-process, taking the
+# same src/dest arguments the process-based methods do.
+def _read_input(src):
+    if isinstance(src, bytes):
+        return src
+    return Path(src).read_bytes()
+
+
+def _write_output(data, dest=None):
+    if dest is None:
+        return data
+
+    dest = Path(dest)
+    with dest.open("xb") as f:
+        f.write(data)
+    return dest
+
+
+# What a runner would raise for a process that exited with returncode
+# after writing data to its stdout, which is dest if given.
+def _process_error(runner, args, returncode, data, dest=None):
+    if dest is not None:
+        _write_output(data, dest)
+        data = None
+
+    return subprocess.CalledProcessError(
+        returncode,
+        [*runner.args_prefix, *args],
+        output=data,
+    )
+
+
 class GzipRunner(ProcessRunner):
     def __init__(self):
         super().__init__("gzip", encoding=None)
 
+    # Python's zlib is what gzip uses as well, so we can avoid running a
+    # process for most things. We decompress member by member like gzip
+    # does to give the same partial results on trailing garbage, which
+    # we get a lot of when searching for compressed data in a vmlinuz.
     def compress(self, src, dest=None):
-        proc = self("-c", "-6", stdin=src, stdout=dest)
-
-        if dest is None:
-            return proc.stdout
-        else:
-            return Path(dest)
+        data = gzip_.compress(_read_input(src), compresslevel=6, mtime=0)
+        return _write_output(data, dest)
 
     def decompress(self, src, dest=None):
-        proc = self("-c", "-d", stdin=src, stdout=dest)
+        def run_gzip():
+            proc = self("-c", "-d", stdin=src, stdout=dest)
 
-        if dest is None:
-            return proc.stdout
-        else:
-            return Path(dest)
+            if dest is None:
+                return proc.stdout
+            else:
+                return Path(dest)
+
+        data = _read_input(src)
+        members = []
+        rest = data
+
+        try:
+            while rest[:2] == b"\x1f\x8b":
+                decomp = zlib_.decompressobj(wbits=31)
+                members.append(decomp.decompress(rest))
+                if not decomp.eof:
+                    raise EOFError(rest)
+                rest = decomp.unused_data
+
+        # Let gzip itself handle truncated or corrupt data
+        except (EOFError, zlib_.error):
+            return run_gzip()
+
+        # Formats gzip can decompress but zlib can't: compress, pack, LZH
+        if not members and data[:2] in (b"\x1f\x9d", b"\x1f\x1e", b"\x1f\xa0"):
+            return run_gzip()
+
+        output = b"".join(members)
+
+        # gzip: not in gzip format
+        if not members:
+            raise _process_error(self, ["-c", "-d"], 1, output, dest)
+
+        # gzip: decompression OK, trailing garbage ignored
+        if rest.strip(b"\x00"):
+            raise _process_error(self, ["-c", "-d"], 2, output, dest)
+
+        return _write_output(output, dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
-        return proc.returncode == 0
+        try:
+            gzip_.decompress(_read_input(path))
+        except (OSError, EOFError, zlib.error):
+            return False
+        return True
 
 
 class Lz4Runner(ProcessRunner):
     def __init__(self):
         super().__init__("lz4", encoding=None)
 
+    # Use python-lz4 if we have it, with the frame options the lz4
+    # program uses by default, and fall back to the program otherwise.
     def compress(self, src, dest=None):
+        if lz4_frame is not None:
+            data = lz4_frame.compress(
+                _read_input(src),
+                compression_level=9,
+                block_size=lz4_frame.BLOCKSIZE_MAX4MB,
+                block_linked=False,
+                content_checksum=True,
+                store_size=False,
+            )
+            return _write_output(data, dest)
+
         proc = self("-z", "-9", stdin=src, stdout=dest)
 
         if dest is None:
@@ -114,7 +311,25 @@ class Lz4Runner(ProcessRunner):
         else:
             return Path(dest)
 
+    # This only decompresses the first frame, leave multiple frames or
+    # trailing data for the program to handle.
+    def _unlz4(self, data):
+        if lz4_frame is None:
+            raise EOFError("python-lz4 is not available")
+        if not data:
+            raise EOFError("Empty lz4 data")
+        output, read = lz4_frame.decompress(data, return_bytes_read=True)
+        return output, data[read:]
+
     def decompress(self, src, dest=None):
+        try:
+            data, rest = self._unlz4(_read_input(src))
+        except (OSError, EOFError, RuntimeError, ValueError):
+            pass
+        else:
+            if not rest:
+                return _write_output(data, dest)
+
         proc = self("-d", stdin=src, stdout=dest)
 
         if dest is None:
@@ -123,23 +338,58 @@ class Lz4Runner(ProcessRunner):
             return Path(dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
-        return proc.returncode == 0
+        if lz4_frame is None:
+            proc = self(
+                "-t", stdin=path,
+                check=False, stderr=subprocess.DEVNULL,
+            )
+            return proc.returncode == 0
+
+        try:
+            data, rest = self._unlz4(_read_input(path))
+        except (OSError, EOFError, RuntimeError, ValueError):
+            return False
+
+        if rest:
+            proc = self(
+                "-t", stdin=path,
+                check=False, stderr=subprocess.DEVNULL,
+            )
+            return proc.returncode == 0
+
+        return True
 
 
 class LzmaRunner(ProcessRunner):
     def __init__(self):
         super().__init__("lzma", encoding=None)
 
+    # Python's lzma module is liblzma, same as the lzma program, so do
+    # it in-process like GzipRunner does.
     def compress(self, src, dest=None):
-        proc = self("-z", stdin=src, stdout=dest)
+        data = lzma_.compress(_read_input(src), format=lzma_.FORMAT_ALONE)
+        return _write_output(data, dest)
+
+    # lzma_.decompress() would silently drop trailing data, but the
+    # lzma program fails on it, so return that for the caller to check.
+    def _unlzma(self, data):
+        decomp = lzma_.LZMADecompressor(format=lzma_.FORMAT_ALONE)
+        output = decomp.decompress(data)
+        if not decomp.eof:
+            raise EOFError("Truncated lzma data")
+        return output, decomp.unused_data
 
-        if dest is None:
-            return proc.stdout
+    def decompress(self, src, dest=None):
+        try:
+            data, rest = self._unlzma(_read_input(src))
+        except (OSError, EOFError, lzma_.LZMAError):
+            pass
         else:
-            return Path(dest)
+            # lzma: Compressed data is corrupt
+            if rest:
+                raise _process_error(self, ["-d"], 1, data, dest)
+            return _write_output(data, dest)
 
-    def decompress(self, src, dest=None):
         proc = self("-d", stdin=src, stdout=dest)
 
         if dest is None:
@@ -148,8 +398,11 @@ class LzmaRunner(ProcessRunner):
             return Path(dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
-        return proc.returncode == 0
+        try:
+            data, rest = self._unlzma(_read_input(path))
+        except (OSError, EOFError, lzma_.LZMAError):
+            return False
+        return not rest
 
 
 class LzopRunner(ProcessRunner):
@@ -173,7 +426,7 @@ class LzopRunner(ProcessRunner):
             return Path(dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
+        proc = self("-t", stdin=path, check=False, stderr=subprocess.DEVNULL)
         return proc.returncode == 0
 
 
@@ -181,15 +434,31 @@ class Bzip2Runner(ProcessRunner):
     def __init__(self):
         super().__init__("bzip2", encoding=None)
 
+    # Python's bz2 module is libbz2 like bzip2 itself, do what we can
+    # in-process like GzipRunner and LzmaRunner.
     def compress(self, src, dest=None):
-        proc = self("-c", stdin=src, stdout=dest)
+        data = bz2.compress(_read_input(src))
+        return _write_output(data, dest)
+
+    # Unlike bzip2, bz2.decompress() accepts empty input and ignores
+    # trailing garbage. Only decompress a single stream here and leave
+    # anything after it for the program to handle.
+    def _bunzip(self, data):
+        decomp = bz2.BZ2Decompressor()
+        output = decomp.decompress(data)
+        if not decomp.eof:
+            raise EOFError("Truncated bzip2 data")
+        return output, decomp.unused_data
 
-        if dest is None:
-            return proc.stdout
+    def decompress(self, src, dest=None):
+        try:
+            data, rest = self._bunzip(_read_input(src))
+        except (OSError, EOFError, ValueError):
+            pass
         else:
-            return Path(dest)
+            if not rest:
+                return _write_output(data, dest)
 
-    def decompress(self, src, dest=None):
         proc = self("-c", "-d", stdin=src, stdout=dest)
 
         if dest is None:
@@ -198,23 +467,53 @@ class Bzip2Runner(ProcessRunner):
             return Path(dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
-        return proc.returncode == 0
+        try:
+            data, rest = self._bunzip(_read_input(path))
+        except (OSError, EOFError, ValueError):
+            return False
+
+        if rest:
+            proc = self(
+                "-t", stdin=path,
+                check=False, stderr=subprocess.DEVNULL,
+            )
+            return proc.returncode == 0
+
+        return True
 
 
 class XzRunner(ProcessRunner):
     def __init__(self):
         super().__init__("xz", encoding=None)
 
+    # Same as LzmaRunner, but for the xz container format
     def compress(self, src, dest=None):
-        proc = self("-z", "--check=crc32", stdin=src, stdout=dest)
+        data = lzma_.compress(
+            _read_input(src),
+            format=lzma_.FORMAT_XZ,
+            check=lzma_.CHECK_CRC32,
+        )
+        return _write_output(data, dest)
+
+    # Like bz2, lzma_.decompress() ignores trailing garbage. Concatenated
+    # streams and stream padding are valid, so leave anything after the
+    # first stream for the program to handle.
+    def _unxz(self, data):
+        decomp = lzma_.LZMADecompressor(format=lzma_.FORMAT_XZ)
+        output = decomp.decompress(data)
+        if not decomp.eof:
+            raise EOFError("Truncated xz data")
+        return output, decomp.unused_data
 
-        if dest is None:
-            return proc.stdout
+    def decompress(self, src, dest=None):
+        try:
+            data, rest = self._unxz(_read_input(src))
+        except (OSError, EOFError, lzma_.LZMAError):
+            pass
         else:
-            return Path(dest)
+            if not rest:
+                return _write_output(data, dest)
 
-    def decompress(self, src, dest=None):
         proc = self("-d", stdin=src, stdout=dest)
 
         if dest is None:
@@ -223,15 +522,38 @@ class XzRunner(ProcessRunner):
             return Path(dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
-        return proc.returncode == 0
+        try:
+            data, rest = self._unxz(_read_input(path))
+        except (OSError, EOFError, lzma_.LZMAError):
+            return False
+
+        if rest:
+            proc = self(
+                "-t", stdin=path,
+                check=False, stderr=subprocess.DEVNULL,
+            )
+            return proc.returncode == 0
+
+        return True
 
 
 class ZstdRunner(ProcessRunner):
     def __init__(self):
         super().__init__("zstd", encoding=None)
 
+    # Use zstandard if we have it, which can also use multiple threads
+    # for compression, and fall back to the program otherwise.
     def compress(self, src, dest=None):
+        if zstd_ is not None:
+            compressor = zstd_.ZstdCompressor(
+                level=9,
+                write_checksum=True,
+                write_content_size=False,
+                threads=-1,
+            )
+            data = compressor.compress(_read_input(src))
+            return _write_output(data, dest)
+
         proc = self("-z", "-9", stdin=src, stdout=dest)
 
         if dest is None:
@@ -239,7 +561,31 @@ class ZstdRunner(ProcessRunner):
         else:
             return Path(dest)
 
+    # Frames might not have their content size, so can't use
+    # ZstdDecompressor.decompress(). Leave multiple frames, trailing
+    # data and the like for the program to handle.
+    def _unzstd(self, data):
+        try:
+            decomp = zstd_.ZstdDecompressor().decompressobj()
+            output = decomp.decompress(data)
+        except zstd_.ZstdError as err:
+            raise ValueError(err) from err
+
+        if not decomp.eof:
+            raise EOFError("Truncated zstd data")
+
+        return output, decomp.unused_data
+
     def decompress(self, src, dest=None):
+        if zstd_ is not None:
+            try:
+                data, rest = self._unzstd(_read_input(src))
+            except (OSError, EOFError, ValueError):
+                pass
+            else:
+                if not rest:
+                    return _write_output(data, dest)
+
         proc = self("-d", stdin=src, stdout=dest)
 
         if dest is None:
@@ -248,7 +594,18 @@ class ZstdRunner(ProcessRunner):
             return Path(dest)
 
     def test(self, path):
-        proc = self("-t", stdin=path, check=False)
+        if zstd_ is not None:
+            try:
+                data, rest = self._unzstd(_read_input(path))
+            except (OSError, EOFError, ValueError):
+                return False
+            if not rest:
+                return True
+
+        proc = self(
+            "-t", stdin=path,
+            check=False, stderr=subprocess.DEVNULL,
+        )
         return proc.returncode == 0
 
 
@@ -263,31 +620,57 @@ class VbutilKernelRunner(ProcessRunner):
 
 
 class CgptRunner(ProcessRunner):
+    # Partition tables only change through our own cgpt calls, so
+    # queries can be reused, e.g. while sorting partitions by flags.
+    cacheable = True
+
     def __init__(self):
         super().__init__("cgpt")
 
+    def _modifies(self, args):
+        return args[:1] not in (("show",), ("find",))
+
+    # Queries take the disk as their last argument
+    def _input_files(self, args):
+        return args[-1:]
+
     def __call__(self, *args, **kwargs):
         proc = super().__call__(*args, **kwargs)
-        lines = proc.stdout.splitlines()
 
         # Sometimes cgpt prints duplicate output.
         # https://bugs.chromium.org/p/chromium/issues/detail?id=463414
-        mid = len(lines) // 2
-        if lines[:mid] == lines[mid:]:
-            proc.stdout = "\n".join(lines[:mid])
+        # That looks like "X\nX\n", compare the halves around the
+        # middle newline without splitting everything into lines.
+        body = proc.stdout
+        if body.endswith("\n"):
+            body = body[:-1]
+
+        mid = len(body) // 2
+        if len(body) % 2 == 0 or body[mid] != "\n":
+            return proc
+
+        # Don't modify proc, it might be a saved result
+        if body[:mid] == body[mid + 1:]:
+            proc = subprocess.CompletedProcess(
+                args=proc.args,
+                returncode=proc.returncode,
+                stdout=body[:mid],
+                stderr=proc.stderr,
+            )
 
         return proc
 
+    _permission_denied_pattern = re.compile(
+        "ERROR: Can't open (.*): Permission denied\n",
+    )
+
     def _parse_subprocess_error(self, err):
         # Exits with nonzero status if it finds no partitions of
         # given type even if the disk has a valid partition table
         if not err.stderr:
             return None
 
-        m = re.fullmatch(
-            "ERROR: Can't open (.*): Permission denied\n",
-            err.stderr,
-        )
+        m = self._permission_denied_pattern.fullmatch(err.stderr)
         if m:
             return PermissionError(
                 "Couldn't open '{}', permission denied."
@@ -346,7 +729,10 @@ class CgptRunner(ProcessRunner):
             # cgpt find needs at least one of -t, -u, -l
             proc = self("show", "-q", "-n", disk)
             lines = proc.stdout.splitlines()
-            partnos = [int(shlex.split(line)[2]) for line in lines]
+
+            # Lines are "start size partno type", separated by spaces
+            # and without any quoting, so no need for shlex here.
+            partnos = [int(line.split(None, 3)[2]) for line in lines]
 
         else:
             proc = self("find", "-n", "-t", type, disk)
@@ -359,11 +745,13 @@ class CgptRunner(ProcessRunner):
 
 
 class CrossystemRunner(ProcessRunner):
+    cacheable = True
+
     def __init__(self):
         super().__init__("crossystem")
 
     def hwid(self):
-        proc = self("hwid", check=False)
+        proc = self("hwid", check=False, stderr=subprocess.DEVNULL)
 
         if proc.returncode == 0:
             return proc.stdout
@@ -371,7 +759,7 @@ class CrossystemRunner(ProcessRunner):
             return None
 
     def fwid(self):
-        proc = self("fwid", check=False)
+        proc = self("fwid", check=False, stderr=subprocess.DEVNULL)
 
         if proc.returncode == 0:
             return proc.stdout
@@ -380,10 +768,22 @@ class CrossystemRunner(ProcessRunner):
 
 
 class FdtgetRunner(ProcessRunner):
+    cacheable = True
+
     def __init__(self):
         super().__init__("fdtget")
 
-    def get(self, dt_file, node='/', prop='', default=None, type=None):
+    # The blob is the first argument after the options
+    def _input_files(self, args):
+        args = iter(args)
+        for arg in args:
+            if arg in ("--default", "--type"):
+                next(args, None)
+            elif not str(arg).startswith("-"):
+                return (arg,)
+        return ()
+
+    def _options(self, default=None, type=None):
         options = []
 
         if default is not None:
@@ -398,41 +798,199 @@ class FdtgetRunner(ProcessRunner):
         elif type is not None:
             options += ["--type", str(type)]
 
-        proc = self(*options, str(dt_file), str(node), str(prop))
+        return options
 
-        # str.split takes too much memory
-        def split(s):
-            for m in re.finditer("(\S*)\s", s):
-                yield m.group()
+    def _parse(self, output, type=None):
+        # Outputs are space-separated values, which can be a lot of
+        # them for binary data. Convert them with map() so the loop
+        # runs in C instead of a generator.
+        tokens = output.split()
 
         if type in (None, int):
             try:
-                data = [int(i) for i in split(proc.stdout)]
+                data = list(map(int, tokens))
                 return data[0] if len(data) == 1 else data
             except:
                 pass
 
         if type in (None, bytes):
             try:
-                # bytes.fromhex("0") doesn't work
-                data = bytes(int(x, 16) for x in split(proc.stdout))
+                # fdtget prints "%x", and bytes.fromhex("0") doesn't work
+                data = bytes(map(int, tokens, itertools.repeat(16)))
                 return data
             except:
                 pass
 
-        data = str(proc.stdout).strip("\n")
+        data = str(output).strip("\n")
         return data
 
+    # Parsed blobs of the few most recently used files, along with the
+    # file identity they were parsed from so a rewritten file is parsed
+    # again. Builds go through every dtb once, don't keep them all.
+    _fdts = collections.OrderedDict()
+    _fdts_maxsize = 8
+
+    def _fdt(self, dt_file):
+        path = str(dt_file)
+        st = os.stat(path)
+        ident = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+        fdts = FdtgetRunner._fdts
+        if path in fdts and fdts[path][0] == ident:
+            fdts.move_to_end(path)
+            return fdts[path][1]
+
+        fdt = libfdt.Fdt(Path(path).read_bytes())
+        fdts[path] = (ident, fdt)
+        fdts.move_to_end(path)
+        if len(fdts) > self._fdts_maxsize:
+            fdts.popitem(last=False)
+
+        return fdt
+
+    # Formats property data the same way fdtget prints it, so that we
+    # can parse it the same way as the process output.
+    def _format(self, data, type=None):
+        if not data:
+            return ""
+
+        if type == str or (type is None and self._is_printable(data)):
+            if data[-1] != 0:
+                raise ValueError("Unterminated string")
+            return bytes(data[:-1]).replace(b"\0", b" ").decode("utf-8")
+
+        if len(data) % 4 == 0:
+            values = struct.unpack(">{}i".format(len(data) // 4), data)
+        elif type == int:
+            raise ValueError("Property length is not a multiple of 4")
+        else:
+            values = data
+
+        return " ".join(map(str, values))
+
+    # Same as the util_is_printable_string() check fdtget does.
+    _printable_pattern = re.compile(rb"(?:[\x20-\x7e]+\0)+\Z")
+
+    def _is_printable(self, data):
+        return self._printable_pattern.match(data) is not None
+
+    def _value(self, fdt, node, prop, default=None, type=None):
+        if type not in (None, str, int, bytes):
+            raise ValueError("Unsupported type '{}'".format(type))
+
+        quiet = libfdt.QUIET_NOTFOUND
+        offset = fdt.path_offset(str(node), quiet)
+        data = None if offset < 0 else fdt.getprop(offset, str(prop), quiet)
+
+        if isinstance(data, int) or data is None:
+            if default is None:
+                raise LookupError(node, prop)
+            return self._parse(str(default), type=type)
+
+        # This is what "%x" formatting and parsing it back would give.
+        if type == bytes:
+            return bytes(data)
+
+        return self._parse(self._format(data, type=type), type=type)
+
+    def get(self, dt_file, node='/', prop='', default=None, type=None):
+        # Use the fdtget process for anything libfdt can't handle, so
+        # errors are the same as without it.
+        if libfdt is not None:
+            try:
+                fdt = self._fdt(dt_file)
+                return self._value(fdt, node, prop, default, type)
+            except Exception:
+                pass
+
+        options = self._options(default=default, type=type)
+        proc = self(*options, str(dt_file), str(node), str(prop))
+        return self._parse(proc.stdout, type=type)
+
+    # Reads multiple (node, prop) pairs from one file with one process,
+    # fdtget prints the value for each pair on its own line.
+    def get_many(self, dt_file, pairs, default=None, type=None):
+        args = [
+            str(x)
+            for node, prop in pairs
+            for x in (node, prop)
+        ]
+        if not args:
+            return []
+
+        if libfdt is not None:
+            try:
+                fdt = self._fdt(dt_file)
+                return [
+                    self._value(fdt, node, prop, default, type)
+                    for node, prop in pairs
+                ]
+            except Exception:
+                pass
+
+        options = self._options(default=default, type=type)
+        proc = self(*options, str(dt_file), *args)
+        return [
+            self._parse(line, type=type)
+            for line in proc.stdout.splitlines()
+        ]
+
+    def _properties(self, fdt, node):
+        quiet = libfdt.QUIET_NOTFOUND
+        offset = fdt.path_offset(str(node), quiet)
+        if offset < 0:
+            return []
+
+        props = []
+        offset = fdt.first_property_offset(offset, quiet)
+        while offset >= 0:
+            props.append(fdt.get_property_by_offset(offset).name)
+            offset = fdt.next_property_offset(offset, quiet)
+
+        return props
+
     def properties(self, dt_file, node='/'):
-        proc = self("--properties", str(dt_file), str(node), check=False)
+        if libfdt is not None:
+            try:
+                return self._properties(self._fdt(dt_file), node)
+            except Exception:
+                pass
+
+        proc = self(
+            "--properties", str(dt_file), str(node),
+            check=False, stderr=subprocess.DEVNULL,
+        )
 
         if proc.returncode == 0:
             return proc.stdout.splitlines()
         else:
             return []
 
+    def _subnodes(self, fdt, node):
+        quiet = libfdt.QUIET_NOTFOUND
+        offset = fdt.path_offset(str(node), quiet)
+        if offset < 0:
+            return []
+
+        nodes = []
+        offset = fdt.first_subnode(offset, quiet)
+        while offset >= 0:
+            nodes.append(fdt.get_name(offset))
+            offset = fdt.next_subnode(offset, quiet)
+
+        return nodes
+
     def subnodes(self, dt_file, node='/'):
-        proc = self("--list", str(dt_file), str(node), check=False)
+        if libfdt is not None:
+            try:
+                return self._subnodes(self._fdt(dt_file), node)
+            except Exception:
+                pass
+
+        proc = self(
+            "--list", str(dt_file), str(node),
+            check=False, stderr=subprocess.DEVNULL,
+        )
         nodes = proc.stdout.splitlines()
 
         if proc.returncode == 0:
@@ -485,11 +1043,16 @@ class FdtputRunner(ProcessRunner):
 
 
 class FileRunner(ProcessRunner):
+    cacheable = True
+
     def __init__(self):
         super().__init__("file")
 
+    def _input_files(self, args):
+        return args[-1:]
+
     def brief(self, path):
-        proc = self("-b", path, check=False)
+        proc = self("-b", path, check=False, stderr=subprocess.DEVNULL)
 
         if proc.returncode == 0:
             return proc.stdout.strip("\n")
@@ -11,8 +11,9 @@ import collections
 import json
 import logging
 import re
+import sys
 
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from pathlib import Path
 
 from depthcharge_tools import __version__
@@ -27,7 +28,9 @@ from depthcharge_tools.utils.collections import (
 )
 from depthcharge_tools.utils.pathlib import (
     iterdir,
+    listdir,
     read_lines,
+    read_text,
 )
 
 
@@ -77,10 +80,27 @@ class update_config(
         self.logger.setLevel(level)
         return verbosity
 
-    def parse_recovery_conf_block(self, block):
-        values = {}
+    def read_recovery_conf_blocks(self, path):
+        # Blocks are separated by empty lines, read the file one block
+        # at a time instead of splitting all of it in memory.
+        lines = []
+
+        with path.open() as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line:
+                    lines.append(line)
+                elif lines:
+                    yield lines
+                    lines = []
+
+        if lines:
+            yield lines
 
-        for line in block.splitlines():
+    def parse_recovery_conf_block(self, lines):
+        all_values = collections.defaultdict(list)
+
+        for line in lines:
             if line.startswith("#"):
                 continue
 
@@ -91,12 +111,13 @@ class update_config(
                     .format(line)
                 )
 
-            if key not in values:
-                values[key] = value
-            elif isinstance(values[key], list):
-                values[key].append(value)
-            else:
-                values[key] = [values[key], value]
+            all_values[key].append(value)
+
+        # Keys that are only given once are plain values
+        values = {
+            key: value[0] if len(value) == 1 else value
+            for key, value in all_values.items()
+        }
 
         if "filesize" in values:
             values["filesize"] = int(values["filesize"] or 0)
@@ -115,16 +136,35 @@ class update_config(
         """
         return Path(path) if path else None
 
-    @property
-    @lru_cache
+    _hwidmatch_codename_pattern = re.compile(
+        r"^\^?\(?([0-9A-Z]+)[^0-9A-Za-z]",
+    )
+
+    # None means the codename from the file name is the right one
+    _hwidmatch_codenames = {
+        "duplicate of rabbid": "rabbid",
+        "duplicate of C433": "shyvana",
+        "Duplicate of BARLA": "barla",
+        "DOES NOT MATCH ANYTHING": None,
+        "NO MATCH JUST FOR ENTRY": None,
+    }
+
+    _hwidmatch_prefixes = (
+        "ACER ZGB", # x86-zgb, x86-zgb-he
+        "IEC MARIO", # x86-mario
+        "SAMS ALEX", # x86-alex, x86-alex-he
+    )
+
+    @cached_property
     def recovery_conf_boards(self):
         if self.recovery_conf is None:
             return {}
 
-        header, *blocks = [
-            self.parse_recovery_conf_block(block)
-            for block in re.split("\n\n+", self.recovery_conf.read_text())
-        ]
+        blocks = (
+            self.parse_recovery_conf_block(lines)
+            for lines in self.read_recovery_conf_blocks(self.recovery_conf)
+        )
+        header = next(blocks, {})
 
         version = header.get(
             "recovery_tool_linux_version",
@@ -144,32 +184,17 @@ class update_config(
             # This might be a parent board, but the best fallback we have
             codename = block.get("file").split("_")[2]
 
-            if hwidmatch == "duplicate of rabbid":
-                codename = "rabbid"
-                block["hwidmatch"] = None
-            elif hwidmatch == "duplicate of C433":
-                codename = "shyvana"
-                block["hwidmatch"] = None
-            elif hwidmatch == "Duplicate of BARLA":
-                codename = "barla"
+            # Not patterns, they say which board the block is for
+            if hwidmatch in self._hwidmatch_codenames:
+                codename = self._hwidmatch_codenames[hwidmatch] or codename
                 block["hwidmatch"] = None
 
-            elif hwidmatch.strip("^(").startswith("ACER ZGB"):
-                pass # x86-zgb, x86-zgb-he
-            elif hwidmatch.strip("^(").startswith("IEC MARIO"):
-                pass # x86-mario
-            elif hwidmatch.strip("^(").startswith("SAMS ALEX"):
-                pass # x86-alex, x86-alex-he
-
-            elif hwidmatch in (
-                "DOES NOT MATCH ANYTHING",
-                "NO MATCH JUST FOR ENTRY",
-            ):
-                codename = block.get("file").split("_")[2]
-                block["hwidmatch"] = None
+            # Patterns that don't start with the board's codename
+            elif hwidmatch.strip("^(").startswith(self._hwidmatch_prefixes):
+                pass
 
             else:
-                m = re.match("^\^?\(?([0-9A-Z]+)[^0-9A-Za-z]", hwidmatch)
+                m = self._hwidmatch_codename_pattern.match(hwidmatch)
                 if m:
                     codename = m.group(1).lower()
                 else:
@@ -188,6 +213,8 @@ class update_config(
         for line in read_lines(d / "profiles" / "repo_name"):
             return line.strip()
 
+    # board_relations looks at each of these twice
+    @lru_cache(maxsize=None)
     def parse_layout_conf(self, d):
         values = {}
 
@@ -247,7 +274,8 @@ class update_config(
             / "generated" / "project-config.json"
         )
         if project_config.is_file():
-            config = json.loads(project_config.read_text())
+            with project_config.open("rb") as f:
+                config = json.load(f)
 
             for section in config["chromeos"]["configs"]:
                 if section["name"]:
@@ -304,17 +332,55 @@ class update_config(
         """
         return Path(path) if path else None
 
+    # Kconfig parsing runs these on every line of every Kconfig file.
+    # The same config names show up in many files and become keys in
+    # a lot of dicts, so the parsers intern them.
+    _kconfig_config_pattern = re.compile("config ([0-9A-Z_]+)")
+    _kconfig_default_pattern = re.compile(r"default (\S+|\".+\")$")
+    _kconfig_default_if_pattern = re.compile(
+        r"default (\S+|\".+\") if ([0-9A-Z_]+)",
+    )
+    _kconfig_select_pattern = re.compile(r"select (\S+|\".+\")$")
+    _kconfig_select_if_pattern = re.compile(
+        r"select (\S+|\".+\") if ([0-9A-Z_]+)",
+    )
+
+    # Converters for default values, by the type of the config
+    _kconfig_types = {
+        "hex": lambda x: int(x, 16),
+        "int": int,
+        "bool": lambda b: b in ("y", "Y"),
+        "string": lambda s: str.strip(s, "'\""),
+    }
+
+    # Splits Kconfig text into blocks separated by empty lines, with
+    # comments removed and lines stripped, in one pass over the text.
+    def split_kconfig_blocks(self, text):
+        block = []
+
+        for line in text.splitlines():
+            comment = line.find("#")
+            if comment >= 0:
+                line = line[:comment]
+
+            # Lines with only whitespace don't separate blocks, but the
+            # parsers stop looking at the rest of the block there.
+            if line:
+                block.append(line.strip())
+            elif block:
+                yield block
+                block = []
+
+        if block:
+            yield block
+
     def parse_kconfig_defaults(self, text):
         defaults = {}
 
-        clean_text, _ = re.subn("#.*\n", "\n", text)
-        blocks = re.split("\n\n+", clean_text)
-        for block in blocks:
+        for block in self.split_kconfig_blocks(text):
             config = None
 
-            for line in block.splitlines():
-                line = line.strip()
-
+            for line in block:
                 if not line or line.startswith("help"):
                     if config is None:
                         continue
@@ -322,64 +388,49 @@ class update_config(
                         config = None
                         break
 
-                m = re.match("config ([0-9A-Z_]+)", line)
-                if m:
-                    config = m.group(1)
-                    type_ = lambda s: str.strip(s, "'\"")
-                    defaults[config] = {}
+                # Most lines aren't interesting, so look at the first
+                # word before trying to match anything against them.
+                keyword = line.split(None, 1)[0]
 
-                if config is None:
+                if keyword == "config":
+                    m = self._kconfig_config_pattern.match(line)
+                    if m:
+                        config = sys.intern(m.group(1))
+                        type_ = self._kconfig_types["string"]
+                        defaults[config] = {}
+
+                elif config is None:
                     continue
 
-                if line.startswith("hex"):
-                    type_ = lambda x: int(x, 16)
-                elif line.startswith("int"):
-                    type_ = int
-                elif line.startswith("bool"):
-                    type_ = lambda b: b in ("y", "Y")
-                elif line.startswith("string"):
-                    type_ = lambda s: str.strip(s, "'\"")
-
-                m = re.match("default (\S+|\".+\")$", line)
-                try:
-                    value = type_(m.group(1).strip("'\""))
-                except ValueError:
-                    value = m.group(1)
-                except AttributeError:
-                    value = None
-                finally:
-                    if value is not None:
+                elif keyword in self._kconfig_types:
+                    type_ = self._kconfig_types[keyword]
+
+                elif keyword == "default":
+                    m = self._kconfig_default_pattern.match(line)
+                    if m:
+                        try:
+                            value = type_(m.group(1).strip("'\""))
+                        except ValueError:
+                            value = m.group(1)
                         defaults[config][None] = value
-                    value = None
-
-                m = re.match("default (\S+|\".+\") if ([0-9A-Z_]+)", line)
-                try:
-                    value = type_(m.group(1))
-                    cond = m.group(2)
-                except ValueError:
-                    value = m.group(1)
-                    cond = m.group(2)
-                except AttributeError:
-                    value = None
-                    cond = None
-                finally:
-                    if value is not None and cond is not None:
-                        defaults[config][cond] = value
-                    value = None
+
+                    m = self._kconfig_default_if_pattern.match(line)
+                    if m:
+                        try:
+                            value = type_(m.group(1))
+                        except ValueError:
+                            value = m.group(1)
+                        defaults[config][sys.intern(m.group(2))] = value
 
         return defaults
 
     def parse_kconfig_selects(self, text):
         selects = {}
 
-        clean_text, _ = re.subn("#.*\n", "\n", text)
-        blocks = re.split("\n\n+", clean_text)
-        for block in blocks:
+        for block in self.split_kconfig_blocks(text):
             config = None
 
-            for line in block.splitlines():
-                line = line.strip()
-
+            for line in block:
                 if not line or line.startswith("help"):
                     if config is None:
                         continue
@@ -387,33 +438,35 @@ class update_config(
                         config = None
                         break
 
-                m = re.match("config ([0-9A-Z_]+)", line)
-                if m:
-                    config = m.group(1)
-                    type_ = lambda s: str.strip(s, "'\"")
-                    selects[config] = {}
-                    selects[config][None] = []
+                keyword = line.split(None, 1)[0]
+
+                if keyword == "config":
+                    m = self._kconfig_config_pattern.match(line)
+                    if m:
+                        config = sys.intern(m.group(1))
+                        selects[config] = {}
+                        selects[config][None] = []
 
-                if config is None:
+                elif config is None:
                     continue
 
-                m = re.match("select (\S+|\".+\")$", line)
-                if m:
-                    value = m.group(1).strip("'\"")
-                    selects[config][None].append(value)
+                elif keyword == "select":
+                    m = self._kconfig_select_pattern.match(line)
+                    if m:
+                        value = sys.intern(m.group(1).strip("'\""))
+                        selects[config][None].append(value)
 
-                m = re.match("select (\S+|\".+\") if ([0-9A-Z_]+)", line)
-                if m:
-                    value = m.group(1)
-                    cond = m.group(2)
-                    if cond not in selects[config]:
-                        selects[config][cond] = []
-                    selects[config][cond].append(value)
+                    m = self._kconfig_select_if_pattern.match(line)
+                    if m:
+                        value = sys.intern(m.group(1))
+                        cond = sys.intern(m.group(2))
+                        if cond not in selects[config]:
+                            selects[config][cond] = []
+                        selects[config][cond].append(value)
 
         return selects
 
-    @property
-    @lru_cache
+    @cached_property
     def depthcharge_boards(self):
         boards = {}
         defaults = collections.defaultdict(dict)
@@ -460,33 +513,38 @@ class update_config(
         """
         return Path(path) if path else None
 
-    @property
-    @lru_cache
+    @cached_property
     def coreboot_boards(self):
         boards = {}
 
         if self.coreboot_repo is None:
             return boards
 
+        # Don't check the filesystem for each config we look at
+        vendors = set(
+            vendor_d.name
+            for vendor_d in iterdir(self.coreboot_repo / "src/mainboard")
+            if vendor_d.is_dir()
+        )
+
+        # Called many times with the same configs while adding boards
+        @lru_cache(maxsize=None)
         def get_board_name(config):
-            parts = config.split("_")
-            if len(parts) < 2 or parts[0] != "BOARD":
+            # BOARD_<VENDOR>_<BOARD>, board part might have underscores
+            prefix, sep, rest = config.partition("_")
+            if prefix != "BOARD" or sep != "_":
                 return None
 
-            vendor = parts[1].lower()
-            if not (self.coreboot_repo / "src/mainboard" / vendor).is_dir():
+            vendor, _, board = rest.partition("_")
+            if vendor.lower() not in vendors:
                 return None
 
-            board = "_".join(config.split("_")[2:]).lower()
-            return board
+            return board.lower()
 
         for kconfig_f in self.coreboot_repo.glob("src/mainboard/*/*/Kconfig"):
             kconfig_name = kconfig_f.with_name("Kconfig.name")
             kconfig = kconfig_f.read_text()
-            if kconfig_name.is_file():
-                kconfig_name = kconfig_name.read_text()
-            else:
-                kconfig_name = ""
+            kconfig_name = read_text(kconfig_name) or ""
 
             defaults = self.parse_kconfig_defaults(kconfig)
             selects = self.parse_kconfig_selects(kconfig)
@@ -553,8 +611,7 @@ class update_config(
 
         return boards
 
-    @property
-    @lru_cache
+    @cached_property
     def board_relations(self):
         board_relations = DirectedGraph()
         repo_names = {}
@@ -583,16 +640,17 @@ class update_config(
 
         for overlay, repo_name in repo_names.items():
             board_d = self.board_overlays_repo / overlay
+            edges = []
 
             for parent in self.get_profiles_base_parent_boards(board_d):
                 if parent != repo_name:
-                    board_relations.add_edge(parent, repo_name)
+                    edges.append((parent, repo_name))
 
             # Various model/skus of recent boards don't have explicit overlay
             # dirs, but are specified in model.yaml in the base overlay
             for child in self.get_model_yaml_boards(board_d):
                 if repo_name != child:
-                    board_relations.add_edge(repo_name, child)
+                    edges.append((repo_name, child))
 
             # Some relations only exists in layout.conf, e.g.
             # - x86-generic -> x86-generic_embedded
@@ -605,10 +663,12 @@ class update_config(
                     "portage-stable",
                     "eclass-overlay",
                 ):
-                    board_relations.add_edge(parent, repo_name)
+                    edges.append((parent, repo_name))
+
+            board_relations.add_edges(*edges)
 
         # "snow" is the default, implicit "daisy"
-        if board_relations.nodes().intersection(("snow", "daisy")):
+        if "snow" in board_relations or "daisy" in board_relations:
             board_relations.add_edge("daisy", "snow")
 
         # Some newer board variants are only in this project repo
@@ -640,7 +700,7 @@ class update_config(
                         board_relations.add_edge(profile.name, child)
 
         # Project repo lists all "veyron" boards under "veyron-pinky"
-        if "veyron-pinky" in board_relations.nodes():
+        if "veyron-pinky" in board_relations:
             board_relations.add_edge("veyron", "veyron-pinky")
             for child in board_relations.children("veyron-pinky"):
                 board_relations.add_edge("veyron", child)
@@ -657,7 +717,7 @@ class update_config(
 
             # src/board/ and BOARD_DIR has gru (baseboard) and veyron_*
             # (variants), we can't just always add "baseboard-".
-            if "baseboard-{}".format(parent) in board_relations.nodes():
+            if "baseboard-{}".format(parent) in board_relations:
                 parent = "baseboard-{}".format(parent)
 
             # This looks incorrect for a few boards, so only add the
@@ -671,11 +731,13 @@ class update_config(
             for node in board_relations.nodes()
         }
 
+        @lru_cache(maxsize=None)
         def coreboot_board_name(config):
             if config is None or not config.startswith("BOARD_"):
                 return None
 
-            board = "_".join(config.split("_")[2:]).lower()
+            _, _, board = config[len("BOARD_"):].partition("_")
+            board = board.lower()
             if board.startswith("baseboard_"):
                 board = "baseboard-{}".format(board[len("baseboard_"):])
 
@@ -684,11 +746,19 @@ class update_config(
 
             return board
 
+        # Doing this again for a board wouldn't add anything, since its
+        # parents are all done and it has at least one of them by then.
+        coreboot_parents_added = set()
+
         def add_coreboot_parents(board):
             if board is None:
                 return None
 
             board = nodes.get(board.replace("-", "_"), board)
+            if board in coreboot_parents_added:
+                return None
+
+            coreboot_parents_added.add(board)
             board_relations.add_node(board)
 
             block = self.coreboot_boards.get(board, {})
@@ -825,8 +895,7 @@ class update_config(
 
         return Path(path).resolve()
 
-    @property
-    @lru_cache
+    @cached_property
     def board_config_sections(self):
         board_relations = self.board_relations
 
@@ -876,6 +945,15 @@ class update_config(
             "chipset-stnyridge": "stoneyridge",
         }
 
+        # The graph doesn't change from here on, and we walk up the same
+        # chains for every board, so count each one's ancestors once.
+        @lru_cache(maxsize=None)
+        def ancestor_count(board):
+            return len(board_relations.ancestors(board))
+
+        # Each board's parent chain is walked again for each of its
+        # descendants, so only decide on a board's parent once.
+        @lru_cache(maxsize=None)
         def get_parent(board):
             # Projects can be the sole parent of actual boards (e.g.
             # freon was to a lot of boards) so don't use them as parents
@@ -890,10 +968,7 @@ class update_config(
                 return None
 
             # Prefer longer chains
-            return max(
-                parents,
-                key=lambda p: len(board_relations.ancestors(p)),
-            )
+            return max(parents, key=ancestor_count)
 
         aliases = {}
         def add_alias(alias, board):
@@ -971,9 +1046,22 @@ class update_config(
 
         return paths
 
+    _fit_compat_pattern = re.compile(
+        r'fit_(?:add|set)_compat(?:_by_rev)?\('
+        r'"([^"]+?)(?:-rev[^-"]+|-sku[^-"]+)*"'
+    )
+
+    _compat_table = str.maketrans("_ ", "--")
+
     def __call__(self):
+        # Sections are sorted again every time they are listed, so split
+        # each name only once.
+        @lru_cache(maxsize=None)
+        def section_key(s):
+            return tuple(s.split('/'))
+
         config = configparser.ConfigParser(
-            dict_type=SortedDict(lambda s: s.split('/')),
+            dict_type=SortedDict(section_key),
         )
 
         for arch in ("x86", "amd64", "arm", "arm64"):
@@ -1005,31 +1093,25 @@ class update_config(
                     config.add_section(name_i)
                     board = config[name_i]
 
-                if block.get("hwidmatch", None):
-                    board["hwid-match"] = block["hwidmatch"]
+                hwid_match = block.get("hwidmatch", None)
+                if hwid_match:
+                    board["hwid-match"] = hwid_match
 
-                if block.get("name", None):
-                    board["name"] = block["name"]
+                board_name = block.get("name", None)
+                if board_name:
+                    board["name"] = board_name
 
         # Some heuristics for kernel compression
         if self.depthcharge_repo is not None:
-            arm64_boot_c = (self.depthcharge_repo / "src/arch/arm/boot64.c")
-            if arm64_boot_c.is_file():
-                arm64_boot_c = arm64_boot_c.read_text()
-            else:
-                arm64_boot_c = ""
-
-            fit_c = (self.depthcharge_repo / "src/boot/fit.c")
-            if fit_c.is_file():
-                fit_c = fit_c.read_text()
-            else:
-                fit_c = ""
-
-            fit_h = (self.depthcharge_repo / "src/boot/fit.h")
-            if fit_h.is_file():
-                fit_h = fit_h.read_text()
-            else:
-                fit_h = ""
+            arm64_boot_c = read_text(
+                self.depthcharge_repo / "src/arch/arm/boot64.c"
+            ) or ""
+            fit_c = read_text(
+                self.depthcharge_repo / "src/boot/fit.c"
+            ) or ""
+            fit_h = read_text(
+                self.depthcharge_repo / "src/boot/fit.h"
+            ) or ""
 
         else:
             arm64_boot_c = ""
@@ -1037,8 +1119,12 @@ class update_config(
             fit_h = ""
 
         if "fit_decompress(kernel" in arm64_boot_c:
-            arm64_lz4_kernel = "CompressionLz4" in fit_h + fit_c
-            arm64_lzma_kernel = "CompressionLzma" in fit_h + fit_c
+            arm64_lz4_kernel = (
+                "CompressionLz4" in fit_h or "CompressionLz4" in fit_c
+            )
+            arm64_lzma_kernel = (
+                "CompressionLzma" in fit_h or "CompressionLzma" in fit_c
+            )
         elif "switch(kernel->compression)" in arm64_boot_c:
             arm64_lz4_kernel = "case CompressionLz4" in arm64_boot_c
             arm64_lzma_kernel = "case CompressionLzma" in arm64_boot_c
@@ -1046,6 +1132,18 @@ class update_config(
             arm64_lz4_kernel = False
             arm64_lzma_kernel = False
 
+        # How fit.c builds compatible strings for boards whose board.c
+        # doesn't set one
+        fit_board_compat = "sprintf(compat, pattern, CONFIG_BOARD," in fit_c
+        fit_mb_part_compat = '"google,%s", mb_part_string' in fit_c
+
+        # List board directories once, instead of trying to open a
+        # board.c for boards that don't have one
+        if self.depthcharge_repo is not None:
+            board_dirs = set(listdir(self.depthcharge_repo / "src/board"))
+        else:
+            board_dirs = set()
+
         for codename, block in self.depthcharge_boards.items():
             name = self.board_config_sections.get(codename, None)
             if name is None:
@@ -1056,8 +1154,9 @@ class update_config(
             board = config[name]
             board["codename"] = codename
 
-            if block.get("KERNEL_SIZE", None):
-                board["image-max-size"] = str(block["KERNEL_SIZE"])
+            kernel_size = block.get("KERNEL_SIZE", None)
+            if kernel_size:
+                board["image-max-size"] = str(kernel_size)
 
             if block.get("KERNEL_FIT", False):
                 board["image-format"] = "fit"
@@ -1068,28 +1167,27 @@ class update_config(
                 board["boots-lz4-kernel"] = str(arm64_lz4_kernel)
                 board["boots-lzma-kernel"] = str(arm64_lzma_kernel)
 
-            # compatible string
-            board_c = (
-                self.depthcharge_repo / "src/board"
-                / codename / "board.c"
-            )
-            board_c = board_c.read_text() if board_c.is_file() else ""
+            # compatible string, only needed for FIT images
             if block.get("KERNEL_FIT", False):
-                m = re.search(
-                    'fit_(?:add|set)_compat(?:_by_rev)?\('
-                    '"([^"]+?)(?:-rev[^-]+|-sku[^-]+)*"',
-                    board_c,
-                )
+                if codename in board_dirs:
+                    board_c = read_text(
+                        self.depthcharge_repo / "src/board"
+                        / codename / "board.c"
+                    ) or ""
+                else:
+                    board_c = ""
+
+                m = self._fit_compat_pattern.search(board_c)
                 if m:
                     board["dt-compatible"] = m.group(1)
 
-                elif "sprintf(compat, pattern, CONFIG_BOARD," in fit_c:
+                elif fit_board_compat:
                     board["dt-compatible"] = "google,{}".format(
                         block.get("BOARD", codename).lower()
-                        .replace("_", "-").replace(" ", "-")
+                        .translate(self._compat_table)
                     )
 
-                elif '"google,%s", mb_part_string' in fit_c:
+                elif fit_mb_part_compat:
                     block = self.coreboot_boards.get(codename, {})
                     mb_part_string = block.get(
                         "MAINBOARD_PART_NUMBER",
@@ -1097,7 +1195,7 @@ class update_config(
                     )
                     board["dt-compatible"] = "google,{}".format(
                         mb_part_string.lower()
-                        .replace("_", "-").replace(" ", "-")
+                        .translate(self._compat_table)
                     )
 
         def graph(config):